@@ -0,0 +1,118 @@
+import heapq
+import math
+import time
+from graph_helper import node_arrays, recovery_bitmasks, get_root, read_gml
+from ratio_heuristic import ratio_order, ratio_heuristic
+
+
+def beam_heuristic(G, independent_nodes, resources, beam_width=64, time_limit=None):
+    """
+    Beam search over recovery orders. Starting from the independent nodes, every partial order in the beam is
+    extended by each node adjacent to its functional nodes, and the beam_width best extensions are kept. A
+    partial order is scored by the utility it has accrued so far, counted the same way RecoveryEnv.recover
+    counts it. Partial orders recovering the same set of nodes have the same future, so only the best of them
+    is kept.
+
+    The search is anytime: once time_limit seconds have passed, the best partial order of the beam is completed
+    greedily with the ratio heuristic and the best complete order found is returned. The ratio heuristic order
+    itself is the starting incumbent, so we never do worse than it.
+
+    :param G: networkx graph G, with attributes utility and demand for each node
+    :param independent_nodes: independent nodes of graph G
+    :param resources: resources per recovery time step
+    :param beam_width: number of partial orders kept at every depth
+    :param time_limit: (optional) time budget in seconds
+    :return: (total utility, recovery config) tuple, total utility excludes independent nodes
+    """
+    start = time.time()
+
+    util, demand = node_arrays(G)
+    nodes, adj, touches_independent = recovery_bitmasks(G, independent_nodes)
+    V = len(nodes)
+    bit = {node: i for i, node in enumerate(nodes)}
+    bit_util = util[nodes].tolist()
+    bit_demand = demand[nodes].tolist()
+    full = (1 << V) - 1
+
+    def completion_round(D):
+        # a node completes in the round its cumulative demand is covered (a node of demand 0 in round 1)
+        return max(math.ceil(D / resources), 1)
+
+    T = completion_round(sum(bit_demand))
+
+    def extend(state, i):
+        accrued, recovered, frontier, D, order = state
+        D += bit_demand[i]
+        recovered |= 1 << i
+        return (accrued + bit_util[i] * (T - completion_round(D) + 1), recovered,
+                (frontier | adj[i]) & ~recovered, D, order + (i,))
+
+    def ratio_completion(state):
+        # recover the best util/demand ratio node adjacent to the functional nodes until we are done
+        while state[2]:
+            frontier = state[2]
+            best = None
+            while frontier:
+                i = (frontier & -frontier).bit_length() - 1
+                frontier &= frontier - 1
+                if best is None or bit_util[i] * bit_demand[best] > bit_util[best] * bit_demand[i]:
+                    best = i
+            state = extend(state, best)
+        return state
+
+    frontier = 0
+    for i in range(V):
+        if touches_independent[i]:
+            frontier |= 1 << i
+
+    # the ratio heuristic order is our starting incumbent
+    incumbent = (0, 0, frontier, 0, ())
+    for node in ratio_order(G, list(independent_nodes))[len(independent_nodes):]:
+        incumbent = extend(incumbent, bit[node])
+    if incumbent[1] != full:
+        raise ValueError('Not every node of G can be reached from the independent nodes')
+
+    beam = [(0, 0, frontier, 0, ())]
+    for depth in range(V):
+        # best extension of every recovered set
+        extensions = {}
+        out_of_time = False
+        for state in beam:
+            if time_limit is not None and time.time() - start > time_limit:
+                out_of_time = True
+                break
+
+            frontier = state[2]
+            while frontier:
+                i = (frontier & -frontier).bit_length() - 1
+                frontier &= frontier - 1
+
+                child = extend(state, i)
+                if child[1] not in extensions or child[0] > extensions[child[1]][0]:
+                    extensions[child[1]] = child
+
+        if out_of_time:
+            # finish the best partial order of the last complete depth greedily
+            beam = [ratio_completion(beam[0])]
+            break
+
+        # keep the best scoring partial orders, breaking ties by the least demand used
+        beam = heapq.nlargest(beam_width, extensions.values(), key=lambda state: (state[0], -state[3]))
+
+    best = max(beam + [incumbent], key=lambda state: state[0])
+
+    # return (total util, recovery config)
+    return (best[0], list(independent_nodes) + [nodes[i] for i in best[4]])
+
+
+def main():
+    graph = read_gml('../gml/GEANT.gml')
+    root = get_root(graph)
+    start = time.time()
+    print('Beam search', beam_heuristic(graph, [root], 1, beam_width=256, time_limit=5))
+    print('Beam time:', time.time() - start)
+    print('Ratio Heuristic', ratio_heuristic(graph, [root], 1))
+
+
+if __name__ == '__main__':
+    main()
@@ -69,6 +69,8 @@ class DeepQNetwork:
         self.memory_s = np.zeros((n_x, self.memory_size))
         self.memory_a = np.zeros((self.memory_size))
         self.memory_r = np.zeros((self.memory_size))
+        # discount of the next state value of each transition, gamma unless a transition spans several rounds
+        self.memory_d = np.full((self.memory_size), self.reward_decay)
         self.memory_s_ = np.zeros((n_x, self.memory_size))
 
         # Config for networks
@@ -98,13 +100,15 @@ class DeepQNetwork:
             self.load_path = load_path
             self.saver.restore(self.sess, self.load_path)
 
-    def store_transition(self, s, a, r, s_):
+    def store_transition(self, s, a, r, s_, discount=None):
         # Replace old memory with new memory
         index = self.memory_counter % self.memory_size
 
         self.memory_s[:, index] = s
         self.memory_a[index] = a
         self.memory_r[index] = r
+        # a semi-MDP transition of k rounds discounts the next state by gamma^k
+        self.memory_d[index] = self.reward_decay if discount is None else discount
         self.memory_s_[:, index] = s_
 
         self.memory_counter += 1
@@ -166,6 +170,7 @@ class DeepQNetwork:
         batch_memory_s = self.memory_s[:, sample_index]
         batch_memory_a = self.memory_a[sample_index]
         batch_memory_r = self.memory_r[sample_index]
+        batch_memory_d = self.memory_d[sample_index]
         batch_memory_s_ = self.memory_s_[:, sample_index]
 
         # Forward propagate eval and target nets to get q values of actions
@@ -187,8 +192,8 @@ class DeepQNetwork:
         # print(q_target_outputs[ actions_index, batch_index ])
 
         # Generate Q target values with Bellman equation
-        q_target_outputs[actions_index, batch_index] = batch_memory_r + self.reward_decay * np.max(q_next_outputs,
-                                                                                                   axis=0)
+        q_target_outputs[actions_index, batch_index] = batch_memory_r + batch_memory_d * np.max(q_next_outputs,
+                                                                                                 axis=0)
         # print('Q targets', q_target_outputs)
 
         # Train eval network
@@ -0,0 +1,378 @@
+import multiprocessing
+import math
+import sys
+import numpy as np
+from graph_helper import node_arrays, recovery_bitmasks, dp_optimality_warning, r_graph, get_root, DP_optimal
+from ratio_heuristic import ratio_order
+
+
+# Exact solvers for the progressive recovery problem which scale further than DP_optimal in graph_helper.py.
+# Every solver here returns the same (max total util, recovery config) tuple as DP_optimal.
+
+
+# Shared state of the parallel DP workers, filled in once per worker by _init_dp_worker
+_dp_shared = {}
+
+
+def _init_dp_worker(Z, B, popcount, util, demand, adj, touches_independent, C):
+    """
+    Pool initializer for par_DP_optimal. The Z, B and popcount tables live in shared memory, so every worker
+    reads the previous layer and writes its shard of the current layer without copying anything.
+    """
+    _dp_shared['Z'] = np.frombuffer(Z, dtype=np.float64)
+    _dp_shared['B'] = np.frombuffer(B, dtype=np.int8)
+    _dp_shared['popcount'] = np.frombuffer(popcount, dtype=np.uint8)
+    _dp_shared['util'] = util
+    _dp_shared['demand'] = demand
+    _dp_shared['adj'] = adj
+    _dp_shared['touches_independent'] = touches_independent
+    _dp_shared['C'] = C
+
+
+def _dp_layer_shard(shard):
+    """
+    Compute Z and B for every subset of size s whose bitmask lies in [lo, hi).
+
+    :param shard: (s, lo, hi) tuple
+    :return: None, results are written to the shared tables
+    """
+    s, lo, hi = shard
+    Z = _dp_shared['Z']
+    B = _dp_shared['B']
+    util = _dp_shared['util']
+    demand = _dp_shared['demand']
+    adj = _dp_shared['adj']
+    touches_independent = _dp_shared['touches_independent']
+    C = _dp_shared['C']
+
+    # X is the set of nodes which are not yet functional, stored as a bitmask
+    X = lo + np.flatnonzero(_dp_shared['popcount'][lo:hi] == s).astype(np.int64)
+    if len(X) == 0:
+        return
+
+    in_X = [((X >> i) & 1).astype(bool) for i in range(len(util))]
+    sum_demands = np.zeros(len(X))
+    for i in range(len(util)):
+        sum_demands += in_X[i] * demand[i]
+
+    # init q to < 0
+    q = np.full(len(X), -1.0)
+    b = np.full(len(X), -1, dtype=np.int8)
+    for i in range(len(util)):
+        # v_i must be adjacent to a functional node (an independent node or a node outside of X)
+        adjacent = in_X[i] & (touches_independent[i] | ((adj[i] & ~X) != 0))
+        if not adjacent.any():
+            continue
+
+        q_ = util[i] * (1 + np.ceil((sum_demands - demand[i]) / C)) + Z[X ^ (1 << i)]
+
+        better = adjacent & (q_ > q)
+        q[better] = q_[better]
+        b[better] = i
+
+    Z[X] = q
+    B[X] = b
+
+
+def par_DP_optimal(G, independent_nodes, resources, processes=None, shards_per_process=4):
+    """
+    Parallel version of DP_optimal. The DP proceeds layer by layer over the subset size s, and every subset in
+    a layer only depends on the previous layer, so each layer is sharded across a process pool. Z and B are
+    numpy tables indexed by subset bitmask in shared memory, instead of dicts keyed by frozenset hashes.
+
+    :param G: networkx graph with attributes "util" and "demand" for each node
+    :param independent_nodes: already functional nodes of the problem, assumed to be list of nodes in G
+    :param resources: resources per turn
+    :param processes: number of worker processes (defaults to the number of cores)
+    :param shards_per_process: number of shards each layer is split into, per process
+    :return: (max total util, recovery config) tuple
+    """
+    util, demand = node_arrays(G)
+    C = resources
+
+    # Optimality checker warning
+    dp_optimality_warning(dict(enumerate(demand)), C)
+
+    nodes, adj, touches_independent = recovery_bitmasks(G, independent_nodes)
+    V = len(nodes)
+    if V > 63:
+        raise ValueError('par_DP_optimal supports at most 63 nodes to recover, got {0}'.format(V))
+
+    # util, demand and adjacency of each bit (bit i is node nodes[i])
+    bit_util = util[nodes]
+    bit_demand = demand[nodes]
+    adj = np.array(adj, dtype=np.int64)
+    touches_independent = np.array(touches_independent, dtype=bool)
+
+    # Z[X] is the best utility of recovering the nodes in X, B[X] the bit recovered first in X
+    Z = multiprocessing.RawArray('d', 1 << V)
+    B = multiprocessing.RawArray('b', 1 << V)
+    np.frombuffer(B, dtype=np.int8)[:] = -1
+
+    # popcount[X] = |X|, built by doubling: setting bit i adds one to every mask of the lower half
+    popcount = np.zeros(1, dtype=np.uint8)
+    for i in range(V):
+        popcount = np.concatenate([popcount, popcount + 1])
+    shared_popcount = multiprocessing.RawArray('B', 1 << V)
+    np.frombuffer(shared_popcount, dtype=np.uint8)[:] = popcount
+    del popcount
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    bounds = np.linspace(1, 1 << V, processes * shards_per_process + 1).astype(np.int64)
+    bounds = sorted(set(bounds.tolist()))
+
+    pool = multiprocessing.Pool(processes, initializer=_init_dp_worker,
+                                initargs=(Z, B, shared_popcount, bit_util, bit_demand, adj, touches_independent, C))
+    try:
+        for s in range(1, V + 1):
+            pool.map(_dp_layer_shard, [(s, lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:])])
+    finally:
+        pool.close()
+        pool.join()
+
+    Z = np.frombuffer(Z, dtype=np.float64)
+    B = np.frombuffer(B, dtype=np.int8)
+
+    # We know independent nodes are first to be recovered
+    opt_plan = list(independent_nodes)
+    Y = (1 << V) - 1
+    while Y:
+        if B[Y] < 0:
+            raise ValueError('Not every node of G can be reached from the independent nodes')
+        opt_plan.append(nodes[B[Y]])
+        Y ^= 1 << int(B[Y])
+
+    # return (max total util, recovery config)
+    return (float(Z[(1 << V) - 1]), opt_plan)
+
+
+def binomial_table(n):
+    """
+    Pascal's triangle as an array, binom[a, b] = a choose b (0 when b > a).
+
+    :param n: largest a in the table
+    :return: (n + 1) x (n + 2) int64 array
+    """
+    binom = np.zeros((n + 1, n + 2), dtype=np.int64)
+    binom[:, 0] = 1
+    for a in range(1, n + 1):
+        binom[a, 1:] = binom[a - 1, 1:] + binom[a - 1, :-1]
+
+    return binom
+
+
+def unrank_combinations(ranks, s, binom):
+    """
+    Inverse of the combinatorial number system: the size s subset of {0, ..., V - 1} at each colex rank,
+    where rank(c_0 < c_1 < ... < c_{s-1}) = sum_k binom(c_k, k + 1).
+
+    :param ranks: 1-D int64 array of ranks
+    :param s: subset size
+    :param binom: table from binomial_table
+    :return: len(ranks) x s array of sorted subset elements
+    """
+    ranks = ranks.copy()
+    combs = np.empty((len(ranks), s), dtype=np.int64)
+    for k in range(s - 1, -1, -1):
+        # c_k is the largest c with binom(c, k + 1) <= rank
+        combs[:, k] = np.searchsorted(binom[:, k + 1], ranks, side='right') - 1
+        ranks -= binom[combs[:, k], k + 1]
+
+    return combs
+
+
+def lean_DP_optimal(G, independent_nodes, resources, chunk_size=1 << 16):
+    """
+    Memory-lean version of DP_optimal. Layer s of the DP only reads layer s - 1, so we keep just those two
+    layers of Z as float arrays indexed by the colex rank of each subset (combinatorial number system). For
+    plan reconstruction we keep the argmax B for every subset, packed as one uint8 per subset.
+
+    :param G: networkx graph with attributes "util" and "demand" for each node
+    :param independent_nodes: already functional nodes of the problem, assumed to be list of nodes in G
+    :param resources: resources per turn
+    :param chunk_size: number of subsets of a layer processed at once, bounds the size of temporaries
+    :return: (max total util, recovery config) tuple
+    """
+    util, demand = node_arrays(G)
+    C = resources
+
+    # Optimality checker warning
+    dp_optimality_warning(dict(enumerate(demand)), C)
+
+    nodes, adj, touches_independent = recovery_bitmasks(G, independent_nodes)
+    V = len(nodes)
+    if V > 62:
+        raise ValueError('lean_DP_optimal supports at most 62 nodes to recover, got {0}'.format(V))
+
+    # util, demand and adjacency of each bit (bit i is node nodes[i])
+    bit_util = util[nodes]
+    bit_demand = demand[nodes]
+    adj = np.array(adj, dtype=np.int64)
+    touches_independent = np.array(touches_independent, dtype=bool)
+    binom = binomial_table(V)
+
+    # B[s][rank] is the bit recovered first among the size s subset with that rank, 255 if there is none
+    B = [np.full(1, 255, dtype=np.uint8)]
+    prev = np.zeros(1)
+
+    for s in range(1, V + 1):
+        cur = np.empty(binom[V, s])
+        B.append(np.empty(binom[V, s], dtype=np.uint8))
+
+        for start in range(0, binom[V, s], chunk_size):
+            ranks = np.arange(start, min(start + chunk_size, binom[V, s]), dtype=np.int64)
+            X = unrank_combinations(ranks, s, binom)
+
+            mask = np.zeros(len(ranks), dtype=np.int64)
+            for k in range(s):
+                mask |= np.left_shift(1, X[:, k])
+            sum_demands = bit_demand[X].sum(axis=1)
+
+            # rank of X - {X[:, j]}: elements below j keep their position, elements above j move down by one
+            below = np.cumsum(binom[X, np.arange(1, s + 1)], axis=1) - binom[X, np.arange(1, s + 1)]
+            above = np.cumsum(binom[X, np.arange(s)][:, ::-1], axis=1)[:, ::-1] - binom[X, np.arange(s)]
+
+            # init q to < 0
+            q = np.full(len(ranks), -1.0)
+            b = np.full(len(ranks), 255, dtype=np.uint8)
+            for j in range(s):
+                v_i = X[:, j]
+                # v_i must be adjacent to a functional node (an independent node or a node outside of X)
+                adjacent = touches_independent[v_i] | ((adj[v_i] & ~mask) != 0)
+
+                q_ = bit_util[v_i] * (1 + np.ceil((sum_demands - bit_demand[v_i]) / C)) + prev[below[:, j] + above[:, j]]
+
+                better = adjacent & (q_ > q)
+                q[better] = q_[better]
+                b[better] = v_i[better]
+
+            cur[ranks] = q
+            B[s][ranks] = b
+
+        prev = cur
+
+    # We know independent nodes are first to be recovered
+    opt_plan = list(independent_nodes)
+    Y = list(range(V))
+    for s in range(V, 0, -1):
+        rank = sum(binom[c, k + 1] for k, c in enumerate(Y))
+        if B[s][rank] == 255:
+            raise ValueError('Not every node of G can be reached from the independent nodes')
+        opt_plan.append(nodes[B[s][rank]])
+        Y.remove(B[s][rank])
+
+    # return (max total util, recovery config)
+    return (float(prev[0]), opt_plan)
+
+
+def branch_and_bound(G, independent_nodes, resources, transpositions=True):
+    """
+    Depth first branch and bound over recovery orders. Only nodes adjacent to the functional nodes are
+    branched on (the same pruning as prune_map), the ratio heuristic order seeds the incumbent, and a branch is
+    cut when an admissible upper bound on its total utility cannot beat the incumbent. The utility of an order
+    is exactly what RecoveryEnv.recover computes (independent nodes excluded).
+
+    Upper bound: the total number of rounds T = ceil(sum(demand) / resources) does not depend on the order, and
+    a node v not yet recovered completes no earlier than round ceil((D + demand[v]) / resources), where D is the
+    demand already recovered. So v adds at most util[v] * (T - that round + 1). Dropping the connectivity
+    constraint and the rounding of completion times, the remaining nodes are best recovered by decreasing
+    util/demand ratio (Smith's rule), which gives a second bound; we cut on the smaller of the two.
+
+    :param G: networkx graph with attributes "util" and "demand" for each node
+    :param independent_nodes: already functional nodes of the problem, assumed to be list of nodes in G
+    :param resources: resources per turn
+    :param transpositions: remember the best utility reached for every recovered set. Two orders of the same
+    set have identical futures, so the worse one is cut (exact, but memory grows with the sets visited).
+    :return: (max total util, recovery config) tuple
+    :raises ValueError: if a node to recover has demand 0 (its round depends on the nodes of demand 0 recovered
+    right before it, see ResourceSchedule.round, which the bounds above do not model)
+    """
+    util, demand = node_arrays(G)
+    nodes, adj, touches_independent = recovery_bitmasks(G, independent_nodes)
+    V = len(nodes)
+    bit = {node: i for i, node in enumerate(nodes)}
+    bit_util = util[nodes].tolist()
+    bit_demand = demand[nodes].tolist()
+    full = (1 << V) - 1
+    if any(d <= 0 for d in bit_demand):
+        raise ValueError('branch_and_bound needs a positive demand for every node to recover')
+
+    def completion_round(D):
+        # a node completes in the round its cumulative demand is covered
+        return math.ceil(D / resources)
+
+    T = completion_round(sum(bit_demand))
+
+    # seed the incumbent with the ratio heuristic
+    best_order = [bit[node] for node in ratio_order(G, list(independent_nodes))[len(independent_nodes):]]
+    if len(best_order) != V:
+        raise ValueError('Not every node of G can be reached from the independent nodes')
+    best_util = 0
+    D = 0
+    for i in best_order:
+        D += bit_demand[i]
+        best_util += bit_util[i] * (T - completion_round(D) + 1)
+
+    # branch on high ratio nodes first (this is also the Smith's rule order of the second bound)
+    branch_order = sorted(range(V), key=lambda i: (-bit_util[i] / bit_demand[i], i))
+    seen = {}
+    order = []
+
+    def search(recovered, frontier, D, accrued):
+        nonlocal best_util, best_order
+
+        if recovered == full:
+            if accrued > best_util:
+                best_util = accrued
+                best_order = list(order)
+            return
+
+        bound = accrued
+        smith_bound = accrued
+        S = D
+        remaining = full & ~recovered
+        for i in branch_order:
+            if remaining >> i & 1:
+                bound += bit_util[i] * (T - completion_round(D + bit_demand[i]) + 1)
+                S += bit_demand[i]
+                smith_bound += bit_util[i] * (T + 1 - S / resources)
+        if min(bound, smith_bound) <= best_util:
+            return
+
+        if transpositions:
+            if seen.get(recovered, -1) >= accrued:
+                return
+            seen[recovered] = accrued
+
+        for i in branch_order:
+            if frontier >> i & 1:
+                D_i = D + bit_demand[i]
+                order.append(i)
+                search(recovered | (1 << i), (frontier | adj[i]) & ~(recovered | (1 << i)), D_i,
+                       accrued + bit_util[i] * (T - completion_round(D_i) + 1))
+                order.pop()
+
+    frontier = 0
+    for i in range(V):
+        if touches_independent[i]:
+            frontier |= 1 << i
+
+    # the search depth is the number of nodes to recover
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), V + 100))
+    search(0, frontier, 0, 0)
+
+    # return (max total util, recovery config)
+    return (best_util, list(independent_nodes) + [nodes[i] for i in best_order])
+
+
+def main():
+    graph = r_graph(n=14, edge_prob=0.2)
+    root = get_root(graph)
+    print(par_DP_optimal(graph, [root], 1))
+    print(DP_optimal(graph, [root], 1))
+    print(branch_and_bound(graph, [root], 1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+import networkx as nx
+import numpy as np
+
+
+# Vectorized random instance generators. Every generator takes a seed (or an np.random.Generator), draws the util
+# and demand of all nodes with a single Generator.integers call, and builds connected graphs constructively: a random
+# spanning tree plus G(n, p) extra edges, instead of regenerating G(n, p) until it happens to be connected. Note that
+# a spanning tree plus G(n, p) is denser than G(n, p) conditioned on being connected, by at most n - 1 edges.
+
+
+def random_attributes(rng, n, util_range=[1, 4], demand_range=[1, 2], batch_size=None):
+    """
+    Draw util and demand for every node with one integers call.
+
+    :param rng: np.random.Generator
+    :param n: number of nodes
+    :param util_range: range to generate random utility from (inclusive)
+    :param demand_range: range to generate random demand from (inclusive)
+    :param batch_size: (optional) draw attributes for a batch of graphs
+    :return: (util, demand) int arrays of shape (n,), or (batch_size, n) for a batch
+    """
+    shape = (n,) if batch_size is None else (batch_size, n)
+    attributes = rng.integers([util_range[0], demand_range[0]], [util_range[1] + 1, demand_range[1] + 1],
+                              size=shape + (2,))
+
+    return attributes[..., 0], attributes[..., 1]
+
+
+def random_tree_edges(rng, n):
+    """
+    Edges of a random spanning tree over nodes 0..n-1: the nodes are visited in a random order and each node is
+    attached to a uniformly chosen node visited before it (a random recursive tree with shuffled labels).
+
+    :param rng: np.random.Generator
+    :param n: number of nodes
+    :return: (n - 1, 2) int array of edges
+    """
+    order = rng.permutation(n)
+    parents = (rng.random(n - 1) * np.arange(1, n)).astype(np.int64)
+
+    return np.stack([order[1:], order[parents]], axis=1)
+
+
+def gnp_edges(rng, n, edge_prob, exclude=None):
+    """
+    Edges of G(n, p) without looping over pairs: we draw how many of the n(n-1)/2 pairs get an edge, choose that
+    many pair indices and unrank them into (i, j) pairs with i > j.
+
+    :param rng: np.random.Generator
+    :param n: number of nodes
+    :param edge_prob: probability of adding an edge for a given pair of nodes
+    :param exclude: (optional) pair of nodes that never gets an edge
+    :return: (k, 2) int array of edges
+    """
+    pairs = n * (n - 1) // 2
+    excluded = None
+    if exclude is not None:
+        i, j = max(exclude), min(exclude)
+        excluded = i * (i - 1) // 2 + j
+        pairs -= 1
+
+    k = rng.binomial(pairs, edge_prob)
+    index = rng.choice(pairs, size=k, replace=False)
+    if excluded is not None:
+        index[index >= excluded] += 1
+
+    # pair index i(i-1)/2 + j, fixing the float estimate of i when it is off by one
+    i = ((1 + np.sqrt(1 + 8 * index.astype(np.float64))) / 2).astype(np.int64)
+    i -= i * (i - 1) // 2 > index
+    i += (i + 1) * i // 2 <= index
+    j = index - i * (i - 1) // 2
+
+    return np.stack([i, j], axis=1)
+
+
+def connected_gnp_edges(rng, n, edge_prob, exclude=None):
+    """
+    Edges of a connected random graph: a random spanning tree plus G(n, p) extras, without duplicates.
+
+    :param rng: np.random.Generator
+    :param n: number of nodes
+    :param edge_prob: probability of adding an edge for a given pair of nodes
+    :param exclude: (optional) pair of nodes that never gets an edge, requires n >= 3
+    :return: (k, 2) int array of edges
+    """
+    tree = random_tree_edges(rng, n)
+
+    if exclude is not None:
+        # rewire the excluded edge if the tree has it: removing it splits the tree in two, and an edge from the other
+        # endpoint to a neighbor of either endpoint joins them again
+        u, v = exclude
+        bad = ((tree[:, 0] == u) & (tree[:, 1] == v)) | ((tree[:, 0] == v) & (tree[:, 1] == u))
+        if bad.any():
+            tree = tree[~bad]
+            for a, b in ((u, v), (v, u)):
+                other = np.concatenate([tree[tree[:, 0] == a, 1], tree[tree[:, 1] == a, 0]])
+                if len(other):
+                    tree = np.vstack([tree, [[other[0], b]]])
+                    break
+
+    edges = np.vstack([tree, gnp_edges(rng, n, edge_prob, exclude)])
+    edges = np.sort(edges, axis=1)
+
+    return np.unique(edges, axis=0)
+
+
+def build_graph(n, edges, util, demand):
+    """
+    Build a networkx graph with util, demand and income attributes the way the graph_helper generators do.
+
+    :param n: number of nodes
+    :param edges: (k, 2) int array of edges
+    :param util: util array of length n
+    :param demand: demand array of length n
+    :return: networkx graph
+    """
+    G = nx.Graph()
+    G.add_nodes_from(range(n))
+    G.add_edges_from(np.asarray(edges).tolist())
+
+    util = dict(enumerate(np.asarray(util).tolist()))
+    demand = dict(enumerate(np.asarray(demand).tolist()))
+    nx.set_node_attributes(G, name='util', values=util)
+    nx.set_node_attributes(G, name='demand', values=demand)
+    nx.set_node_attributes(G, name='income', values={x: util[x] - demand[x] for x in util})
+
+    return G
+
+
+def random_tree(n, util_range=[1, 4], demand_range=[1, 2], seed=None):
+    """
+    Generates a random tree, with random utility and demand for each node
+
+    :param n: number of nodes
+    :param util_range: range to generate random utility from (inclusive)
+    :param demand_range: range to generate random demand from (inclusive)
+    :param seed: int seed or np.random.Generator
+    :return: random tree with util, demand set for each node
+    """
+    rng = np.random.default_rng(seed)
+    util, demand = random_attributes(rng, n, util_range, demand_range)
+
+    return build_graph(n, random_tree_edges(rng, n), util, demand)
+
+
+def random_graph(n, edge_prob, util_range=[1, 4], demand_range=[1, 2], seed=None):
+    """
+    Generates a connected random graph with n nodes: a random spanning tree, plus an edge between pairs of nodes
+    with probability edge_prob.
+
+    :param n: number of nodes
+    :param edge_prob: probability of adding an edge for a given pair of nodes
+    :param util_range: range to generate random utility from (inclusive)
+    :param demand_range: range to generate random demand from (inclusive)
+    :param seed: int seed or np.random.Generator
+    :return: random graph with util, demand set for each node
+    """
+    rng = np.random.default_rng(seed)
+    util, demand = random_attributes(rng, n, util_range, demand_range)
+
+    return build_graph(n, connected_gnp_edges(rng, n, edge_prob), util, demand)
+
+
+def grid_graph(n, m, util_range=[1, 4], demand_range=[1, 2], seed=None):
+    """
+    Generates an nxm 2d grid graph, with random utility and demand for each node
+
+    :param n: side of grid len
+    :param m: ** above
+    :param util_range: range to generate random utility from (inclusive)
+    :param demand_range: range to generate random demand from (inclusive)
+    :param seed: int seed or np.random.Generator
+    :return: grid graph with nxm nodes, numbered row by row
+    """
+    rng = np.random.default_rng(seed)
+    util, demand = random_attributes(rng, n * m, util_range, demand_range)
+
+    index = np.arange(n * m).reshape(n, m)
+    edges = np.vstack([np.stack([index[:, :-1].ravel(), index[:, 1:].ravel()], axis=1),
+                       np.stack([index[:-1, :].ravel(), index[1:, :].ravel()], axis=1)])
+
+    return build_graph(n * m, edges, util, demand)
+
+
+def gnp_adversarial(n, util_range=[1, 4], demand_range=[1, 2], edge_prob=0.2, adv_node_util=10, seed=None):
+    """
+    Generates a connected random graph like random_graph, without an edge between node 0 and node n - 2, and makes
+    node n - 2 a counter example for the ratio heuristic: a high utility node whose neighbors all have a bad ratio.
+
+    :param n: number of nodes >= 3
+    :param util_range: range to generate random utility from (inclusive)
+    :param demand_range: range to generate random demand from (inclusive)
+    :param edge_prob: probability of adding an edge for a given pair of nodes
+    :param adv_node_util: util of adversarial node
+    :param seed: int seed or np.random.Generator
+    :return: random graph with util, demand set for each node
+    """
+    rng = np.random.default_rng(seed)
+    util, demand = random_attributes(rng, n, util_range, demand_range)
+    edges = connected_gnp_edges(rng, n, edge_prob, exclude=(0, n - 2))
+
+    neighbors = np.concatenate([edges[edges[:, 0] == n - 2, 1], edges[edges[:, 1] == n - 2, 0]])
+    util[n - 2] = adv_node_util
+    demand[n - 2] = demand_range[0]
+    util[neighbors] = util_range[0]
+    demand[neighbors] = demand_range[1]
+
+    return build_graph(n, edges, util, demand)
+
+
+def random_graph_batch(batch_size, n, edge_prob=None, util_range=[1, 4], demand_range=[1, 2], seed=None):
+    """
+    Generates a batch of connected random graphs as stacked arrays, e.g. for a vector environment.
+
+    :param batch_size: number of graphs
+    :param n: number of nodes of every graph
+    :param edge_prob: probability of adding an edge for a given pair of nodes, None for random trees
+    :param util_range: range to generate random utility from (inclusive)
+    :param demand_range: range to generate random demand from (inclusive)
+    :param seed: int seed or np.random.Generator
+    :return: (adjacency, util, demand) with a (batch_size, n, n) uint8 adjacency matrix and (batch_size, n) util and
+    demand arrays. build_graph(n, np.argwhere(np.triu(adjacency[b])), util[b], demand[b]) gives graph b.
+    """
+    rng = np.random.default_rng(seed)
+    util, demand = random_attributes(rng, n, util_range, demand_range, batch_size)
+
+    adjacency = np.zeros((batch_size, n, n), dtype=np.uint8)
+    for b in range(batch_size):
+        if edge_prob is None:
+            edges = random_tree_edges(rng, n)
+        else:
+            edges = connected_gnp_edges(rng, n, edge_prob)
+        adjacency[b, edges[:, 0], edges[:, 1]] = 1
+        adjacency[b, edges[:, 1], edges[:, 0]] = 1
+
+    return adjacency, util, demand
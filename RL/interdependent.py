@@ -0,0 +1,364 @@
+import math
+import random
+import time
+import networkx as nx
+import numpy as np
+from graph_helper import r_graph, node_arrays, resource_schedule
+from n_size_env import n_environment
+
+
+# Interdependent (multi-layer) recovery. Besides the physical network, a LayeredNetwork holds VNF layers whose nodes
+# depend on supporting nodes in other layers, e.g. a VNF on the physical node hosting it. A node is functional when it
+# is recovered, all of its supporting nodes are functional, and, if its layer has independent nodes, it is adjacent
+# to a functional node of its own layer (i.e. connected to an independent node of the layer through functional
+# nodes). Layers without independent nodes only need the dependencies. The single graph model of the other modules is
+# the special case of one layer and no dependencies.
+#
+# Nodes of all layers share one numbering 0..N-1, and each node has util, demand and layer attributes. Recovery works
+# as everywhere else: resources are spent on the nodes in order, so the k-th node is recovered in round
+# r_k = ceil(D_k / resources) (see ResourceSchedule for resources that change over time), and a node that becomes
+# functional in round r adds its utility to every round from r to the last round T.
+
+
+class LayeredNetwork:
+    def __init__(self, G, dependencies, independent_nodes):
+        """
+        :param G: networkx graph with nodes 0..N-1 and attributes util, demand and layer (defaults to 0) for each
+        node. Only edges between nodes of the same layer count as connectivity.
+        :param dependencies: list of (supporter, dependent) node pairs
+        :param independent_nodes: nodes functional from the start
+        """
+        self.G = G
+        self.number_of_nodes = G.number_of_nodes()
+        self.independent_nodes = list(independent_nodes)
+        self.dependencies = list(dependencies)
+
+        self.util, self.demand = node_arrays(G)
+        layer = nx.get_node_attributes(G, 'layer')
+        self.layer = np.array([layer.get(v, 0) for v in range(self.number_of_nodes)], dtype=np.int64)
+
+        # same layer adjacency, supporters and dependents as lists of neighbors per node
+        self.adj = [[u for u in G.neighbors(v) if self.layer[u] == self.layer[v]] for v in range(self.number_of_nodes)]
+        self.supporters = [[] for v in range(self.number_of_nodes)]
+        self.dependents = [[] for v in range(self.number_of_nodes)]
+        for supporter, dependent in self.dependencies:
+            self.supporters[dependent].append(supporter)
+            self.dependents[supporter].append(dependent)
+
+        # nodes that need a functional neighbor in their layer
+        layers_with_independent = set(self.layer[self.independent_nodes].tolist())
+        self.needs_connection = np.array([self.layer[v] in layers_with_independent and v not in self.independent_nodes
+                                          for v in range(self.number_of_nodes)], dtype=bool)
+
+    @classmethod
+    def from_layers(cls, layers, dependencies, independent_nodes):
+        """
+        Build a LayeredNetwork from one graph per layer.
+
+        :param layers: list of networkx graphs with attributes util and demand for each node
+        :param dependencies: list of ((layer, node), (layer, node)) (supporter, dependent) pairs
+        :param independent_nodes: list of (layer, node) pairs
+        :return: LayeredNetwork, node v of layer i is node offsets[i] + index of v in layers[i].nodes()
+        """
+        G = nx.Graph()
+        index = {}
+        for i, layer in enumerate(layers):
+            for v in layer.nodes():
+                index[(i, v)] = len(index)
+                G.add_node(index[(i, v)], util=layer.nodes[v]['util'], demand=layer.nodes[v]['demand'], layer=i)
+            G.add_edges_from((index[(i, u)], index[(i, v)]) for u, v in layer.edges())
+
+        return cls(G, [(index[s], index[d]) for s, d in dependencies], [index[v] for v in independent_nodes])
+
+
+class FunctionalEvaluator:
+    """
+    Incremental functional set of a LayeredNetwork under recovery. Recovering a node only visits the nodes that become
+    functional because of it, their same layer neighbors and their dependents, so evaluating a whole recovery order
+    costs O(N + E + dependencies).
+    """
+
+    def __init__(self, network):
+        """
+        :param network: LayeredNetwork
+        """
+        self.network = network
+        n = network.number_of_nodes
+        self.recovered = np.zeros(n, dtype=bool)
+        self.functional = np.zeros(n, dtype=bool)
+        self.connected = ~network.needs_connection
+        self.missing_support = np.array([len(x) for x in network.supporters], dtype=np.int64)
+        self.utility = 0
+
+        self.recovered[network.independent_nodes] = True
+        self.functional[network.independent_nodes] = True
+        self.propagate(list(network.independent_nodes))
+
+    def ready(self, v):
+        return self.recovered[v] and not self.functional[v] and self.missing_support[v] == 0 and self.connected[v]
+
+    def propagate(self, newly_functional):
+        """
+        Work through the consequences of nodes becoming functional.
+
+        :param newly_functional: nodes that just became functional, extended with every node that follows
+        :return: newly_functional
+        """
+        network = self.network
+        stack = list(newly_functional)
+        while stack:
+            w = stack.pop()
+            for u in network.adj[w]:
+                self.connected[u] = True
+                if self.ready(u):
+                    self.functional[u] = True
+                    stack.append(u)
+                    newly_functional.append(u)
+            for u in network.dependents[w]:
+                self.missing_support[u] -= 1
+                if self.ready(u):
+                    self.functional[u] = True
+                    stack.append(u)
+                    newly_functional.append(u)
+
+        return newly_functional
+
+    def recover(self, v):
+        """
+        Recover node v.
+
+        :param v: node
+        :return: list of nodes that became functional
+        """
+        self.recovered[v] = True
+        if not self.ready(v):
+            return []
+
+        self.functional[v] = True
+        newly_functional = self.propagate([v])
+        self.utility += self.network.util[newly_functional].sum().item()
+
+        return newly_functional
+
+
+def evaluate_order(network, order, resources):
+    """
+    Total utility of a recovery order, counted like RecoveryEnv.recover: the utility of every non independent node
+    for every round it is functional, until the last node is recovered.
+
+    :param network: LayeredNetwork
+    :param order: recovery order of the non independent nodes
+    :param resources: resources per recovery time step, or a schedule of resources per round (see ResourceSchedule)
+    :return: total utility
+    """
+    evaluator = FunctionalEvaluator(network)
+    demands = network.demand[list(order)]
+    rounds = resource_schedule(resources).rounds(np.cumsum(demands), demands).tolist()
+    T = rounds[-1] if rounds else 0
+
+    total_utility = 0
+    for v, r in zip(order, rounds):
+        total_utility += network.util[evaluator.recover(v)].sum().item() * (T - r + 1)
+
+    return total_utility
+
+
+def layered_ratio_heuristic(network, resources):
+    """
+    Ratio heuristic for interdependent networks: recover the best util/demand node among the nodes that become
+    functional as soon as they are recovered, falling back to the best ratio node among the rest when there is none.
+
+    :param network: LayeredNetwork
+    :param resources: resources per recovery time step
+    :return: (total utility, recovery config) tuple, total utility excludes independent nodes
+    """
+    evaluator = FunctionalEvaluator(network)
+    ratio = [u / d if d else math.inf for u, d in zip(network.util.tolist(), network.demand.tolist())]
+
+    order = []
+    remaining = set(range(network.number_of_nodes)) - set(network.independent_nodes)
+    while remaining:
+        immediate = [v for v in remaining if evaluator.missing_support[v] == 0 and evaluator.connected[v]]
+        v = max(immediate or remaining, key=lambda x: (ratio[x], -x))
+        evaluator.recover(v)
+        remaining.remove(v)
+        order.append(v)
+
+    return evaluate_order(network, order, resources), network.independent_nodes + order
+
+
+def layered_DP_optimal(network, resources):
+    """
+    Exact optimal recovery order by dynamic programming over the sets of recovered nodes. The functional set only
+    depends on the recovered set, so recovering node v last among a set S adds the utility of S - {v} for the rounds
+    from the last node of S - {v} to v, and the utility of S for the round of v (like n_environment). Any node can be recovered at any time (a node that
+    cannot be functional yet may still be worth recovering early), so this is 2^N * N work and memory: use it for up
+    to ~20 non independent nodes.
+
+    :param network: LayeredNetwork
+    :param resources: resources per recovery time step, or a schedule of resources per round (see ResourceSchedule)
+    :return: (total utility, recovery config) tuple, total utility excludes independent nodes
+    """
+    schedule = resource_schedule(resources)
+    nodes = [v for v in range(network.number_of_nodes) if v not in network.independent_nodes]
+    V = len(nodes)
+    bit = {v: 1 << v for v in range(network.number_of_nodes)}
+    supporters = [sum(bit[s] for s in network.supporters[v]) for v in nodes]
+    adj = [sum(bit[u] for u in network.adj[v]) for v in nodes]
+    needs_connection = network.needs_connection[nodes].tolist()
+    util = network.util.tolist()
+    demand = network.demand[nodes].tolist()
+    independent_util = sum(util[v] for v in network.independent_nodes)
+
+    def functional_set(recovered, functional):
+        # grow the functional set (as a bitmask over all nodes) to its fixpoint for a set of recovered local bits
+        changed = True
+        while changed:
+            changed = False
+            for i in range(V):
+                if recovered >> i & 1 and not functional & bit[nodes[i]] and not supporters[i] & ~functional and \
+                        (not needs_connection[i] or adj[i] & functional):
+                    functional |= bit[nodes[i]]
+                    changed = True
+        return functional
+
+    def mask_utility(functional):
+        return sum(util[v] for v in range(network.number_of_nodes) if functional >> v & 1) - independent_util
+
+    # the round of a node of demand 0 depends on how many nodes of demand 0 were recovered right before it (see
+    # ResourceSchedule.round), so the states are (S, j) for j such nodes at the end of S
+    runs = sum(1 for d in demand if d == 0) + 1
+
+    def last_round(S, j):
+        # round of the last node of S
+        if j > 0:
+            return schedule.round(cumulative_demand[S], 0, j)
+        return schedule.round(cumulative_demand[S], 1) if S else 0
+
+    size = 1 << V
+    functional = [0] * size
+    functional[0] = functional_set(0, sum(bit[v] for v in network.independent_nodes))
+    functional_utility = np.zeros(size)
+    cumulative_demand = np.zeros(size)
+    best = np.full((size, runs), -math.inf)
+    best[0, 0] = 0
+    choice = np.full((size, runs), -1, dtype=np.int64)
+    previous_run = np.zeros((size, runs), dtype=np.int64)
+
+    for S in range(1, size):
+        low = (S & -S).bit_length() - 1
+        cumulative_demand[S] = cumulative_demand[S & (S - 1)] + demand[low]
+        functional[S] = functional_set(S, functional[S & (S - 1)])
+        functional_utility[S] = mask_utility(functional[S])
+
+        D = cumulative_demand[S]
+        rest = S
+        while rest:
+            i = (rest & -rest).bit_length() - 1
+            rest &= rest - 1
+            P = S ^ (1 << i)
+            gained = functional_utility[S] - functional_utility[P]
+            for j in range(runs - 1 if demand[i] == 0 else runs):
+                if best[P, j] == -math.inf:
+                    continue
+                # the rounds from the last node of P to node i count the utility of P, the round of i also counts i
+                k = j + 1 if demand[i] == 0 else 0
+                r = schedule.round(D, demand[i], k)
+                value = best[P, j] + (r - last_round(P, j)) * functional_utility[P] + gained
+                if value > best[S, k]:
+                    best[S, k] = value
+                    choice[S, k] = i
+                    previous_run[S, k] = j
+
+    # walk back the choices to get the order
+    order = []
+    S = size - 1
+    j = int(np.argmax(best[S]))
+    total = best[S, j].item()
+    while S:
+        i = int(choice[S, j])
+        order.append(nodes[i])
+        S, j = S ^ (1 << i), int(previous_run[S, j])
+    order.reverse()
+
+    return total, network.independent_nodes + order
+
+
+class layered_n_environment(n_environment):
+    """
+    Node selection environment (see n_size_env) for a LayeredNetwork. The reward of a step is still
+    (r_k - r_{k-1}) * U_{k-1} + (U_k - U_{k-1}), where U is now the utility of the functional nodes of all layers.
+    """
+
+    def __init__(self, network, resources, frontier_only=True):
+        """
+        :param network: LayeredNetwork
+        :param resources: resources per recovery step
+        :param frontier_only: random and ratio actions only pick nodes that are functional as soon as they are
+        recovered (or any node that is not recovered when there are none)
+        """
+        self.network = network
+        super().__init__(network.G, network.independent_nodes, resources, frontier_only)
+
+    def reset(self):
+        self.evaluator = FunctionalEvaluator(self.network)
+        return super().reset()
+
+    def update_functional(self, nodes):
+        """
+        Copy the functional nodes found by the evaluator, and update the frontier: nodes that are not recovered, have
+        all their supporters functional and a functional neighbor (if their layer needs one).
+
+        :param nodes: nodes that just became functional
+        """
+        evaluator = self.evaluator
+        if not self.functional.any():
+            # first call, from reset, every node may be affected
+            self.functional[:] = evaluator.functional
+            self.frontier[:] = ~evaluator.recovered & (evaluator.missing_support == 0) & evaluator.connected
+            return
+
+        for w in nodes:
+            self.functional[w] = True
+            for u in self.network.adj[w] + self.network.dependents[w]:
+                if not evaluator.recovered[u] and evaluator.missing_support[u] == 0 and evaluator.connected[u]:
+                    self.frontier[u] = True
+
+    def recover(self, action):
+        self.state[action] = 1
+        self.frontier[action] = False
+        self.update_functional(self.evaluator.recover(action))
+
+
+def random_layered_network(n_physical, n_vnf, edge_prob=0.3, util_range=[1, 4], demand_range=[1, 2], seed=None):
+    """
+    Random two layer instance: a connected random physical graph, and a random graph of VNFs each hosted on a random
+    physical node. Physical node 0 is independent, the VNF layer only depends on its hosts.
+
+    :param n_physical: number of physical nodes
+    :param n_vnf: number of VNFs
+    :param edge_prob: probability of adding an edge for a given pair of nodes of a layer
+    :param util_range: range to generate random utility from (inclusive)
+    :param demand_range: range to generate random demand from (inclusive)
+    :param seed: random seed
+    :return: LayeredNetwork
+    """
+    # r_graph reseeds the global generators, so the VNF layer gets its own (nonzero) seed drawn from ours
+    rng = random.Random(seed)
+    physical = r_graph(n_physical, edge_prob, util_range, demand_range, seed)
+    vnf = r_graph(n_vnf, edge_prob, util_range, demand_range, rng.randrange(1, 2 ** 32) if seed is not None else None)
+    hosts = [((0, rng.randrange(n_physical)), (1, v)) for v in range(n_vnf)]
+
+    return LayeredNetwork.from_layers([physical, vnf], hosts, [(0, 0)])
+
+
+def main():
+    network = random_layered_network(8, 6, seed=42)
+    start = time.time()
+    print('Layered ratio heuristic', layered_ratio_heuristic(network, 1))
+    print('Layered DP optimal', layered_DP_optimal(network, 1))
+    print('time:', time.time() - start)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+import math
+import multiprocessing
+import random
+import time
+import numpy as np
+from graph_helper import node_arrays, recovery_bitmasks, get_root, read_gml, resource_schedule
+from ratio_heuristic import ratio_heuristic
+
+
+# Monte Carlo tree search over recovery orders. A state is the set of recovered nodes (a bitmask over the nodes
+# we need to recover), an action recovers a node adjacent to the functional nodes, and the reward of an action
+# is the node selection reward of n_environment, so the rewards of an order add up to the total utility
+# RecoveryEnv.recover gives it. The future of a state only depends on the recovered set and, through the round of
+# a node of demand 0 (see ResourceSchedule.round), on the number j of nodes of demand 0 recovered last in a row, so
+# the search tree is a transposition table keyed by (bitmask, j).
+
+
+# Problem arrays and search table of a worker, filled in by _init_mcts_worker
+_mcts_shared = {}
+
+
+def _init_mcts_worker(problem):
+    """
+    Pool initializer, every worker receives the problem once and keeps its own search table across decisions.
+
+    :param problem: dict built by mcts_heuristic
+    """
+    _mcts_shared.clear()
+    _mcts_shared.update(problem)
+    _mcts_shared['table'] = {}
+
+
+def _frontier_nodes(frontier):
+    nodes = []
+    while frontier:
+        nodes.append((frontier & -frontier).bit_length() - 1)
+        frontier &= frontier - 1
+    return nodes
+
+
+def _expand(recovered, frontier):
+    """
+    Create the table entry of a state: [visits, {action: [visits, total return, prior]}].
+    """
+    problem = _mcts_shared
+    actions = _frontier_nodes(frontier)
+
+    if problem['prior'] is None:
+        priors = np.ones(len(actions))
+    elif problem['prior'] == 'ratio':
+        priors = np.array([problem['ratio'][i] for i in actions])
+        if np.isinf(priors).any():
+            # nodes of demand 0 have an infinite ratio, they share the prior
+            priors = np.isinf(priors).astype(float)
+    else:
+        # a callable prior scores every node of G given the 0/1 functional state, e.g. the q values of a DQN
+        # with one output per node. We softmax the scores of the possible actions.
+        state = np.zeros(problem['number_of_nodes'])
+        state[problem['independent_nodes']] = 1
+        state[[problem['nodes'][i] for i in range(len(problem['nodes'])) if recovered >> i & 1]] = 1
+        scores = np.asarray(problem['prior'](state), dtype=float)[[problem['nodes'][i] for i in actions]]
+        priors = np.exp(scores - scores.max())
+
+    priors = priors / priors.sum()
+    return [0, {a: [0, 0.0, p] for a, p in zip(actions, priors)}]
+
+
+def _step(state, i):
+    """
+    Recover node i, returning the new state and the reward of doing so: the utility of the recovered nodes for
+    the rounds from the previous node to node i, and of node i in its own round.
+
+    :param state: (recovered, frontier, D, j, utility, round) tuple, D the cumulative demand, j the number of nodes
+    of demand 0 recovered last in a row, utility the utility of the recovered nodes and round the round of the
+    last recovered node (0 at the start)
+    """
+    problem = _mcts_shared
+    recovered, frontier, D, j, utility, previous_round = state
+    D += problem['demand'][i]
+    j = j + 1 if problem['demand'][i] == 0 else 0
+    recovered |= 1 << i
+    completion_round = problem['schedule'].round(D, problem['demand'][i], j)
+    reward = (completion_round - previous_round) * utility + problem['util'][i]
+
+    next_state = (recovered, (frontier | problem['adj'][i]) & ~recovered, D, j, utility + problem['util'][i],
+                  completion_round)
+    return next_state, reward
+
+
+def _rollout(state, rng):
+    """
+    Finish the recovery epsilon-greedily with respect to the util/demand ratio, returning the utility gained.
+    """
+    problem = _mcts_shared
+    total = 0
+    while state[1]:
+        actions = _frontier_nodes(state[1])
+        if rng.random() < problem['rollout_epsilon']:
+            i = rng.choice(actions)
+        else:
+            i = max(actions, key=lambda a: problem['ratio'][a])
+        state, reward = _step(state, i)
+        total += reward
+
+    return total
+
+
+def _mcts_search(task):
+    """
+    Run simulations from a root state with the worker's search table.
+
+    :param task: (state, simulations, seed) tuple, see _step for the state
+    :return: {action: (visits, total return)} at the root
+    """
+    root, simulations, seed = task
+    problem = _mcts_shared
+    table = problem['table']
+    rng = random.Random(seed)
+
+    root_key = (root[0], root[3])
+    if root_key not in table:
+        table[root_key] = _expand(root[0], root[1])
+
+    for simulation in range(simulations):
+        # selection: descend with PUCT until we reach a state we have not expanded yet
+        path = []
+        state = root
+        ret = 0
+        while state[1] and (state[0], state[3]) in table:
+            key = (state[0], state[3])
+            entry = table[key]
+            sqrt_visits = math.sqrt(entry[0] + 1)
+            best, best_score = None, -math.inf
+            for a, (n, w, p) in entry[1].items():
+                q = w / n / problem['scale'] if n else 0
+                score = q + problem['c_puct'] * p * sqrt_visits / (1 + n)
+                if score > best_score:
+                    best, best_score = a, score
+
+            next_state, reward = _step(state, best)
+            path.append((key, best, reward))
+            state = next_state
+
+        # expansion and evaluation by rollout
+        if state[1]:
+            table[(state[0], state[3])] = _expand(state[0], state[1])
+            ret = _rollout(state, rng)
+
+        # backup the return from each state along the path
+        for s, a, reward in reversed(path):
+            ret += reward
+            table[s][0] += 1
+            stats = table[s][1][a]
+            stats[0] += 1
+            stats[1] += ret
+
+    return {a: (n, w) for a, (n, w, p) in table[root_key][1].items()}
+
+
+def mcts_heuristic(G, independent_nodes, resources, simulations=1000, processes=1, prior='ratio', c_puct=1.5,
+                   rollout_epsilon=0.3, seed=None):
+    """
+    Plan a recovery order with Monte Carlo tree search. Before every decision we run a fixed number of
+    simulations from the current state, selecting actions with PUCT, and then recover the most visited node.
+    With processes > 1 the simulations of a decision are split over a process pool (root parallelization) and
+    the root statistics of the workers are summed.
+
+    :param G: networkx graph G, with attributes utility and demand for each node
+    :param independent_nodes: independent nodes of graph G
+    :param resources: resources per recovery time step, or a schedule of resources per round (see ResourceSchedule)
+    :param simulations: simulations per decision
+    :param processes: number of worker processes, 1 searches in this process
+    :param prior: None for uniform priors, 'ratio' for priors proportional to util/demand, or a callable mapping
+    the 0/1 functional state of G to one score per node (e.g. the q values of a DQN with a node per output),
+    which are softmaxed over the possible actions. A callable prior must be picklable when processes > 1.
+    :param c_puct: exploration constant
+    :param rollout_epsilon: probability of a random action in a rollout, otherwise the best ratio node
+    :param seed: random seed
+    :return: (total utility, recovery config) tuple, total utility excludes independent nodes
+    """
+    util, demand = node_arrays(G)
+    nodes, adj, touches_independent = recovery_bitmasks(G, independent_nodes)
+    V = len(nodes)
+    bit_util = util[nodes].tolist()
+    bit_demand = demand[nodes].tolist()
+    schedule = resource_schedule(resources)
+
+    # latest round the last node can be recovered in, when the nodes of demand 0 all come last
+    zero_demand = sum(1 for d in bit_demand if d == 0)
+    T = max(schedule.round(sum(bit_demand), 1), schedule.round(sum(bit_demand), 0, zero_demand) if zero_demand else 1)
+
+    problem = {
+        'nodes': nodes,
+        'number_of_nodes': G.number_of_nodes(),
+        'independent_nodes': list(independent_nodes),
+        'util': bit_util,
+        'demand': bit_demand,
+        'ratio': [u / d if d else math.inf for u, d in zip(bit_util, bit_demand)],
+        'adj': adj,
+        'schedule': schedule,
+        # returns are divided by the largest possible return so that q values are in [0, 1]
+        'scale': max(sum(bit_util) * T, 1),
+        'prior': prior,
+        'c_puct': c_puct,
+        'rollout_epsilon': rollout_epsilon,
+    }
+
+    rng = random.Random(seed)
+    _init_mcts_worker(problem)
+    pool = None
+    if processes > 1:
+        pool = multiprocessing.Pool(processes, initializer=_init_mcts_worker, initargs=(problem,))
+
+    recovered = 0
+    frontier = 0
+    for i in range(V):
+        if touches_independent[i]:
+            frontier |= 1 << i
+    state = (recovered, frontier, 0, 0, 0, 0)
+    total_utility = 0
+    order = []
+
+    try:
+        while state[1]:
+            if pool is None:
+                root_stats = [_mcts_search((state, simulations, rng.random()))]
+            else:
+                tasks = [(state, math.ceil(simulations / processes), rng.random()) for x in range(processes)]
+                root_stats = pool.map(_mcts_search, tasks)
+
+            # sum the root statistics and recover the most visited node
+            visits = {}
+            for stats in root_stats:
+                for a, (n, w) in stats.items():
+                    visits[a] = (visits.get(a, (0, 0))[0] + n, visits.get(a, (0, 0))[1] + w)
+            action = max(visits, key=lambda a: (visits[a][0], visits[a][1]))
+
+            state, reward = _step(state, action)
+            total_utility += reward
+            order.append(action)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if len(order) != V:
+        raise ValueError('Not every node of G can be reached from the independent nodes')
+
+    # return (total util, recovery config)
+    return (total_utility, list(independent_nodes) + [nodes[i] for i in order])
+
+
+def main():
+    graph = read_gml('../gml/GEANT.gml')
+    root = get_root(graph)
+    start = time.time()
+    print('MCTS', mcts_heuristic(graph, [root], 1, simulations=400, processes=multiprocessing.cpu_count(), seed=42))
+    print('MCTS time:', time.time() - start)
+    print('Ratio Heuristic', ratio_heuristic(graph, [root], 1))
+
+
+if __name__ == '__main__':
+    main()
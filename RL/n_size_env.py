@@ -1,159 +1,216 @@
 import networkx as nx
 import numpy as np
 import math
-import copy
-from graph_helper import r_tree, get_root, DP_optimal, plot_graph
 import random
+from graph_helper import r_tree, get_root, DP_optimal, plot_graph, node_arrays, evaluate_orders, resource_schedule
 
 
-# TODO: Fully test. Have not used this yet.
 # This is another version of rl_environment which only has n-actions. Instead of "allocating resources" at each time
-# step, we simply choose what node to bring online. Therefore, each episode will only last n steps, given a graph
-# G with n nodes.
+# step, we simply choose what node to bring online next. Therefore, each episode will only last n steps, given a graph
+# G with n nodes, and the network of a DeepQNetwork has one output per node.
+#
+# Resources are spent on the chosen nodes in order, excess resources of a round carrying over to the next node, so
+# node k (in recovery order) is recovered in round r_k = ceil(D_k / resources), where D_k is the cumulative demand of
+# the first k nodes (with a schedule of resources per round, the first round whose cumulative resources cover D_k,
+# see ResourceSchedule). The reward of choosing node k is the utility accrued from the round after r_{k-1} up to r_k:
+# (r_k - r_{k-1}) * U_{k-1} + (U_k - U_{k-1}), where U_k is the utility of the functional nodes once the first k nodes
+# are recovered. The rewards of an episode sum to the total utility RecoveryEnv.recover gives the same order.
 class n_environment:
-    def __init__(self, G, independent_nodes, resources):
-        '''
+    def __init__(self, G, independent_nodes, resources, frontier_only=True):
+        """
         :param G: networkx graph with utility and demand attribute set for each node
         :param independent_nodes: Initial independent nodes of G
-        :param resources: resources per recovery step (used in calculation of maximum rounds)
-        '''
+        :param resources: resources per recovery step, or a schedule of resources per round (see ResourceSchedule)
+        :param frontier_only: random and ratio actions only pick nodes adjacent to the functional nodes
+        """
         self.G = G
         self.number_of_nodes = G.number_of_nodes()
+        self.independent_nodes = list(independent_nodes)
+        self.resources = resources
+        self.schedule = resource_schedule(resources)
+        self.frontier_only = frontier_only
 
-        # stays constant across episodes so when we reset we do it cleanly
-        self.G_constant = copy.deepcopy(G)
-        self.independent_nodes = independent_nodes
+        self.util, self.demand = node_arrays(G)
+        self.start_demand = nx.get_node_attributes(G, 'demand')
 
-        self.start_demand = nx.get_node_attributes(self.G_constant, 'demand')
+        # adjacency as CSR arrays, the neighbors of v are indices[indptr[v]:indptr[v + 1]]
+        neighbors = [list(G.neighbors(v)) for v in range(self.number_of_nodes)]
+        self.indptr = np.cumsum([0] + [len(x) for x in neighbors])
+        self.indices = np.array([u for x in neighbors for u in x], dtype=np.int64)
 
-        # state is an indicator matrix for each node in G. 0 -> node is offline
+        # total utility we can get out of the nodes we recover
+        self.total_utility = self.util.sum() - self.util[self.independent_nodes].sum()
+
+        self.reset()
+
+    def reset(self):
+        """
+        Reset our state to starting state, return the initial observation
+
+        :return: initial state, 'False' done boolean
+        """
+        # state is an indicator vector for each node in G. 0 -> node is offline
         # initially, every node is except for independent nodes
-        self.state = [0 for x in range(self.number_of_nodes)]
-        print('independent nodes:', self.independent_nodes)
-        for node in self.independent_nodes:
-            self.state[node] = 1
+        self.state = np.zeros(self.number_of_nodes, dtype=np.int8)
+        self.state[self.independent_nodes] = 1
 
-        # max rounds is math.ceil(sum(d) / resources)
-        self.round = 1
-        self.resources = resources
+        # functional nodes are recovered nodes connected to an independent node, the frontier are the nodes
+        # adjacent to them that are not recovered yet
+        self.functional = np.zeros(self.number_of_nodes, dtype=bool)
+        self.frontier = np.zeros(self.number_of_nodes, dtype=bool)
+        self.update_functional(self.independent_nodes)
+
+        # cumulative demand of the recovered nodes, round in which the last of them was recovered and the
+        # utility of the functional nodes (not counting independent nodes)
+        self.cumulative_demand = 0
+        self.round = 0
+        self.current_utility = 0
 
-        # excess reward save
-        self.excess_resources = 0
+        # number of nodes of demand 0 recovered in a row since the last node with demand, see ResourceSchedule.round
+        self.zero_run = 0
 
         # True when state is vector of 1's
         self.done = False
 
-    def random_action(self):
+        return self.observation(), self.done
+
+    def observation(self):
         """
-        Return a random action from our current state.
-        :return: random action (scalar)
+        :return: remaining demand of every node, 0 once a node is recovered
         """
-        not_recovered = [x if self.state[x] is 0 else None for x in range(self.number_of_nodes)]
+        return np.where(self.state == 1, 0, self.demand)
 
-        return np.random.choice(not_recovered)
+    def update_functional(self, nodes):
+        """
+        Mark nodes as functional, along with every recovered node they connect to the functional nodes, and update the
+        frontier. Subclasses with another notion of functional nodes override this.
 
-    def step(self, action):
+        :param nodes: nodes that just became functional
         """
-        Take a step in our environment.
-        :param action: scalar corresponding to node to be recovered
-        :return: 3-tuple of (new_state, reward, done)
+        stack = list(nodes)
+        for v in stack:
+            self.functional[v] = True
+        while stack:
+            v = stack.pop()
+            self.frontier[v] = False
+            for u in self.indices[self.indptr[v]:self.indptr[v + 1]]:
+                if self.state[u] == 1 and not self.functional[u]:
+                    self.functional[u] = True
+                    stack.append(u)
+                elif self.state[u] == 0:
+                    self.frontier[u] = True
+
+    def recover(self, action):
         """
-        demand = nx.get_node_attributes(self.G_constant, 'demand')
-        util = nx.get_node_attributes(self.G_constant, 'util')
+        Bring node action online and update the functional nodes.
 
-        # apply excess resources
-        demand[action] -= self.excess_resources
-        rounds_to_recover = math.ceil(demand[action] / self.resources)
-        # now our new excess will be whatever we have left over after recovering our cur node
-        self.excess_resources = demand[action] % self.resources
-        demand[action] = 0
-
-        # Compute the subgraph before and after bringing the next node online.
-        # Before: we count utility of all functional nodes for rounds_to_recover - 1 nodes
-        self.G = self.G_constant.subgraph([x if self.state[x] == 1 else None for x in range(len(self.state))])
+        :param action: node to recover
+        """
+        self.state[action] = 1
+        self.frontier[action] = False
+        adjacent = self.indices[self.indptr[action]:self.indptr[action + 1]]
+        if self.functional[adjacent].any():
+            self.update_functional([action])
 
-        # count utility only for nodes which have a path to an independent node
-        count_utility = []
-        for node in self.G:
-            for id_node in self.independent_nodes:
-                if nx.has_path(self.G, id_node, node) and id_node != node:
-                    count_utility.append(node)
+    def functional_utility(self):
+        """
+        :return: utility of the functional nodes, not counting independent nodes
+        """
+        return self.util[self.functional].sum() - self.util[self.independent_nodes].sum()
 
-        util_before = (rounds_to_recover - 1) * sum(
-            [util[x] if x in count_utility else 0 for x in range(self.number_of_nodes)])
+    def possible_actions(self):
+        """
+        :return: nodes we may recover next, the frontier of the functional nodes if frontier_only (or every node
+        that is not recovered when nothing is adjacent to the functional nodes)
+        """
+        if self.frontier_only and self.frontier.any():
+            return np.flatnonzero(self.frontier)
 
-        # update state, calculate the "after" util
-        # print(demand)
-        self.state = [1 if demand[x] == 0 or self.state[x] == 1 else 0 for x in range(self.number_of_nodes)]
-        print(self.state)
+        return np.flatnonzero(self.state == 0)
 
-        # G becomes subgraph of functional nodes
-        self.G = self.G_constant.subgraph([x if self.state[x] == 1 else None for x in range(len(self.state))])
+    def random_action(self, return_indices=False):
+        """
+        Return a random action from our current state.
 
-        # count utility only for nodes which have a path to an independent node
-        count_utility = []
-        for node in self.G:
-            for id_node in self.independent_nodes:
-                if nx.has_path(self.G, id_node, node) and id_node != node:
-                    count_utility.append(node)
+        :param return_indices: return every possible action instead, e.g. to pick the best q value among them
+        :return: random action (scalar), or list of possible actions
+        """
+        actions = self.possible_actions()
+        if return_indices:
+            return actions.tolist()
 
-        util_after = sum([util[x] if x in count_utility else 0 for x in range(self.number_of_nodes)])
-        reward = util_after + util_before
+        return int(random.choice(actions))
 
-        # check if we are done
-        if sum(self.state) == self.number_of_nodes:
-            self.done = True
+    def ratio_action(self):
+        """
+        Best action based on ratio heuristic.
 
-        # check if we have reached round limit, which is:
-        # ceil(sum(demands of non-independent nodes) / resources per turn)
-        independent_node_demand = [self.start_demand[x] for x in self.independent_nodes]
+        :return: possible action with the best util/demand ratio
+        """
+        actions = self.possible_actions()
+        with np.errstate(divide='ignore'):
+            ratios = np.where(self.demand[actions] > 0, self.util[actions] / self.demand[actions], np.inf)
 
-        if self.round >= (math.ceil((sum(self.start_demand.values()) - sum(independent_node_demand)) / self.resources)):
-            self.done = True
+        return int(actions[np.argmax(ratios)])
 
-        self.round += rounds_to_recover
+    def step(self, action, debug=False, neg=False):
+        """
+        Take a step in our environment.
 
-        # update demand values in our current graph
-        nx.set_node_attributes(self.G_constant, name='demand', values=demand)
-        new_state = [demand[x] for x in range(self.number_of_nodes)]
+        :param action: scalar corresponding to node to be recovered
+        :param debug: print output data for test runs
+        :param neg: scale rewards like rl_environment, subtracting the utility of the nodes that are not functional
+        in every round
+        :return: 3-tuple of (new_state, reward, done)
+        """
+        if self.state[action] == 1:
+            raise ValueError('Node {0} is already recovered'.format(action))
 
-        return new_state, reward, self.done
+        # round in which this node is recovered, with the excess resources of earlier rounds carried over (a node
+        # without demand is recovered in the round after the last one)
+        self.cumulative_demand += self.demand[action]
+        self.zero_run = self.zero_run + 1 if self.demand[action] == 0 else 0
+        recovery_round = self.schedule.round(self.cumulative_demand, self.demand[action], self.zero_run)
+        rounds_to_recover = recovery_round - self.round
 
-    def reset(self):
-        """
-        Reset our state to starting state, return the initial observation
+        utility_before = self.current_utility
+        self.recover(action)
+        self.current_utility = self.functional_utility()
 
-        :return: initial state, 'False' done boolean
-        """
-        self.G = copy.deepcopy(self.G_constant)
-        self.state = [0 for x in range(self.number_of_nodes)]
-        for node in self.independent_nodes:
-            self.state[node] = 1
+        # utility of the rounds we spend on this node, the last of which already counts the nodes recovered in it
+        reward = rounds_to_recover * utility_before + (self.current_utility - utility_before)
+        if neg:
+            reward = 2 * reward - rounds_to_recover * self.total_utility
+        reward = reward.item() if isinstance(reward, np.generic) else reward
 
-        # reset demands, we don't modify utils
-        nx.set_node_attributes(self.G_constant, name='demand', values=self.start_demand)
+        if debug:
+            print('action', action, 'round', recovery_round, 'reward', reward)
 
-        # True when state is vector of 1's
-        self.done = False
-        self.round = 1
+        self.round = recovery_round
+        self.done = bool(self.state.all())
 
-        return self.state, self.done
+        return self.observation(), reward, self.done
 
 
 def main():
-    # test
+    # check that the rewards of an episode add up to the total utility of the recovery order
     num_nodes = 8
     G = r_tree(num_nodes)
-    plot_graph(G, 0, 'environment_debug_graph.png')
-    env = n_environment(G, [0], 1)
-    for x in range(1, num_nodes):
-        print(env.step(x))
-
-    env.reset()
-    print('Reset env =========================')
-    while not env.done:
-        print(env.step(random.randint(0, num_nodes - 1)))
-        print()
+    root = get_root(G)
+    env = n_environment(G, [root], 1)
+
+    order = [root]
+    total = 0
+    observation, done = env.reset()
+    while not done:
+        action = env.random_action()
+        order.append(action)
+        observation, reward, done = env.step(action, debug=True)
+        total += reward
+
+    util, demand = node_arrays(G)
+    print('episode reward', total, 'recovery utility', evaluate_orders(order[1:], util, demand, 1))
+    print('DP optimal', DP_optimal(G, [root], 1))
 
 
 if __name__ == "__main__":
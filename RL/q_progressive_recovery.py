@@ -1,17 +1,24 @@
 from deep_q_network import DeepQNetwork
 from rl_environment import environment
+from n_size_env import n_environment
 import networkx as nx
 from graph_helper import r_graph, r_2d_graph, r_tree, get_root, DP_optimal, plot_graph, simulate_tree_recovery, \
     plot_bar_x, read_gml, adv_graph, read_gml_adversarial, gnp_adversarial
 import numpy as np
 from ratio_heuristic import ratio_heuristic
 from random_heuristic import random_heuristic
+from exact_solvers import par_DP_optimal
+import graph_generators
+from scenario_library import ScenarioLibrary
 import time
 import random
 import tensorflow as tf
 
 
 def generate_graph(nodes=20, utils=[1, 4], demands=[1, 2], load_dir=None, type='random_tree', seed=None):
+    # Node 0 is the independent node of the generated graphs, library scenarios come with their own
+    independent_nodes = [0]
+
     # Generate random tree
     if type == 'random_tree':
         if load_dir:
@@ -30,6 +37,12 @@ def generate_graph(nodes=20, utils=[1, 4], demands=[1, 2], load_dir=None, type='
         save = 'experiments/{0}_rgraph.txt'.format(nodes)
         real_node_num = nodes
 
+    # Generate a connected random graph constructively, a random spanning tree plus edges with p-value 0.2
+    elif type == 'connected_random_graph':
+        graph = graph_generators.random_graph(nodes, 0.2, utils, demands, seed)
+        save = 'experiments/{0}_crgraph.txt'.format(nodes)
+        real_node_num = nodes
+
     # Generate random nodes x nodes 2-d grid graph
     elif type == 'grid':
         if load_dir:
@@ -66,14 +79,42 @@ def generate_graph(nodes=20, utils=[1, 4], demands=[1, 2], load_dir=None, type='
         save = 'experiments/{0}_gnp_adv_graph.txt'.format(nodes)
         real_node_num = nodes
 
+    # Load a scenario from a scenario library file (see scenario_library.py). Here nodes is the index
+    # of the scenario in the library, utils and demands come from the library.
+    elif type == 'library':
+        library = ScenarioLibrary(load_dir)
+        graph, independent_nodes = library.graph(nodes)
+        save = 'experiments/{0}.txt'.format(library.names[nodes])
+        real_node_num = len(graph)
+
     else:
         raise NotImplementedError
 
     # Real number of nodes may be different from input node num (in the case of grid graph)
-    return graph, save, real_node_num
+    return graph, independent_nodes, save, real_node_num
+
 
+def build_environment(G, independent_nodes, resources, node_selection=False, semi_mdp=False, gamma=0.9):
+    """
+    Build the learning environment of runner.
 
-def runner(node_num):
+    :param node_selection: the agent picks the next node to recover (n actions, n steps per episode) instead of
+    allocating the resources of every round to a pair of nodes
+    :param semi_mdp: commit to a node until it recovers, one transition per recovered node. Every node selection
+    step already recovers a node, so the two can't be combined.
+    :param gamma: discount per round, used to aggregate the rewards of a semi-MDP step
+    :return: environment or n_environment
+    """
+    if node_selection and semi_mdp:
+        raise ValueError('semi_mdp only applies to the resource allocation environment, not to node_selection')
+
+    if node_selection:
+        return n_environment(G, independent_nodes, resources)
+
+    return environment(G, independent_nodes, resources, semi_mdp=semi_mdp, gamma=gamma)
+
+
+def runner(node_num, node_selection=False, semi_mdp=False):
     # Load checkpoint
     load_path = "weights/weights.ckpt"
     save_path = "weights/weights.ckpt"
@@ -85,16 +126,13 @@ def runner(node_num):
 
     # Generate graph for training...
     resources = 1
-    # G, reward_save, num_nodes = generate_graph(nodes=node_num, type='gnp_adversarial')
-    # G, reward_save, num_nodes = generate_graph(load_dir='../gml/ibm.gml', type='gml')
-    G, reward_save, num_nodes = generate_graph(nodes=node_num, type='random_graph', seed=42)
-
-    # Pick an arbitrary node to be the root
-    root = 0
+    # G, independent_nodes, reward_save, num_nodes = generate_graph(nodes=node_num, type='gnp_adversarial')
+    # G, independent_nodes, reward_save, num_nodes = generate_graph(load_dir='../gml/ibm.gml', type='gml')
+    G, independent_nodes, reward_save, num_nodes = generate_graph(nodes=node_num, type='random_graph', seed=42)
     # Try plotting. If on ssh, don't bother since there are some necessary plt.draw() commands
     # to plot a networkx graph.
     try:
-        plot_graph(G, root, 'rl_graph.png')
+        plot_graph(G, independent_nodes[0], 'rl_graph.png')
     except:
         print('No display')
 
@@ -103,13 +141,14 @@ def runner(node_num):
     # laplacian_matrix = nx.laplacian_matrix(G).toarray()
     # flat_laplacian = laplacian_matrix.flatten()
 
-    # Build the learning environment
-    env = environment(G, [root], resources)
+    # Build the learning environment, see build_environment
+    reward_decay = 0.6
+    env = build_environment(G, independent_nodes, resources, node_selection, semi_mdp, reward_decay)
     print('num_edges:', G.number_of_edges())
-    print("Ratio Heuristic", ratio_heuristic(G, [root], resources), '\n')
+    print("Ratio Heuristic", ratio_heuristic(G, independent_nodes, resources), '\n')
 
     # Our observation space
-    n_y = len(env.actions_permutations)
+    n_y = num_nodes if node_selection else len(env.actions_permutations)
 
     # Initialize DQN
     DQN = DeepQNetwork(
@@ -121,7 +160,7 @@ def runner(node_num):
         replace_target_iter=20,
         memory_size=20000,
         batch_size=256,
-        reward_decay=0.6,
+        reward_decay=reward_decay,
         epsilon_min=0.1,
         epsilon_greedy_decrement=5e-5,
         # load_path=load_path,
@@ -170,7 +209,7 @@ def runner(node_num):
             observation_, reward, done = env.step(action, neg=False)
             # print(observation_, reward, done)
             # 3. Store transition
-            DQN.store_transition(observation, action, reward, observation_)
+            DQN.store_transition(observation, action, reward, observation_, env.discount if semi_mdp else None)
 
             episode_reward += reward
 
@@ -260,10 +299,14 @@ def runner(node_num):
         true_r += r
 
     results = []
-    # if we have a reasonable number of nodes (< 24), we can compute optimal using DP
-    if num_nodes < 24:
+    # if we have a reasonable number of nodes (< 24), we can compute optimal using DP, and up to 28 nodes
+    # the parallel DP still fits its tables in memory
+    if num_nodes <= 28:
         dp_time = time.time()
-        results.append(DP_optimal(G, [root], resources))
+        if num_nodes < 24:
+            results.append(DP_optimal(G, independent_nodes, resources))
+        else:
+            results.append(par_DP_optimal(G, independent_nodes, resources))
         print('DP Opt: ', results[0])
         dp_time_end = time.time()
         results.append(dp_time_end - dp_time)
@@ -272,17 +315,17 @@ def runner(node_num):
         results.append('n/a')
         results.append('n/a')
 
-    print('\n Random Heuristic', random_heuristic(G, [root], resources), '\n')
-    results.append(random_heuristic(G, [root], resources))
+    print('\n Random Heuristic', random_heuristic(G, independent_nodes, resources), '\n')
+    results.append(random_heuristic(G, independent_nodes, resources))
 
     # Only works on trees
-    # print('\n Tree Heuristic:', simulate_tree_recovery(G, resources, root, clean=False), '\n')
+    # print('\n Tree Heuristic:', simulate_tree_recovery(G, resources, independent_nodes[0], clean=False), '\n')
 
     ratio_time_start = time.time()
-    print('\n Ratio Heuristic', ratio_heuristic(G, [root], resources))
+    print('\n Ratio Heuristic', ratio_heuristic(G, independent_nodes, resources))
     ratio_time_end = time.time()
     print('Ratio time:', ratio_time_end - ratio_time_start)
-    results.append(ratio_heuristic(G, [root], resources))
+    results.append(ratio_heuristic(G, independent_nodes, resources))
     results.append(ratio_time_end - ratio_time_start)
 
     print('\n reward during training:', reward)
@@ -1,5 +1,7 @@
+import heapq
 import networkx as nx
-from graph_helper import plot_graph, calc_height, simulate_tree_recovery, plot_bar_x, r_tree, get_root, merge_nodes, r_graph, DP_optimal
+from graph_helper import plot_graph, calc_height, simulate_tree_recovery, plot_bar_x, r_tree, get_root, merge_nodes, r_graph, DP_optimal, \
+    node_arrays, evaluate_orders, resource_schedule
 
 # TODO:
 # 1. Test multiple independent nodes for optimality (we are only comparing against U-D heuristic
@@ -21,12 +23,19 @@ class RecoveryEnv:
         """
         Recover our network with the order given.
         :param order: |network| len list with order of nodes to recover
-        :param resources: resources per time step (assumed constant)
+        :param resources: resources per time step, or a schedule of resources per round (see ResourceSchedule)
         :param include_independent_nodes: include recovering independent nodes in the total_utility count
         :param debug: print step by step recovery order to check if correct
         :param draw: draw graph at each step of recovery
         :return: total utility
         """
+        if not debug and not draw:
+            # the closed form gives the same total utility, the round by round walk below is only needed to
+            # print or plot every step
+            util, demand = node_arrays(self.network)
+            start = 0 if include_independent_nodes else len(self.independent_nodes)
+            return evaluate_orders(order[start:], util, demand, resources)
+
         demand = nx.get_node_attributes(self.network, 'demand')
         utils = nx.get_node_attributes(self.network, 'util')
 
@@ -48,11 +57,16 @@ class RecoveryEnv:
         total_utility = 0
         remaining_resources = 0
 
+        # round we are in, counting from 1, which sets the resources we get when we run out
+        schedule = resource_schedule(resources)
+        t = 1
+
         if not include_independent_nodes:
             node_recovery_index += len(self.independent_nodes)
 
         # keep a copy of our graph to plot change over time/ recovery order more intuitively
-        H = self.network.copy()
+        if draw:
+            H = self.network.copy()
 
         # iteration counter for saving intermediate graphs
         i = 0
@@ -70,18 +84,19 @@ class RecoveryEnv:
                 print('Recovering node: ', recovery_node, [utils[recovery_node], demand[recovery_node]])
 
             # Use all remaining resources if we had some from the previous turn, otherwise
-            # the amount of resources we are allocated this turn is our constant resource income
+            # the amount of resources we are allocated this turn is our resource income for round t
             if remaining_resources != 0:
                 resources_this_turn = remaining_resources
                 remaining_resources = 0
             else:
-                resources_this_turn = resources
+                resources_this_turn = schedule.budget(t)
 
             # if our demand is greater than the resources at this time step, apply all resources
             # and continue to the next step
             if demand[recovery_node] > resources_this_turn:
                 demand[recovery_node] -= resources_this_turn
                 total_utility += current_utility
+                t += 1
                 continue
 
             # If demand < supply this turn, we don't increment total utility yet
@@ -91,7 +106,8 @@ class RecoveryEnv:
                 remaining_resources = resources_this_turn - demand[recovery_node]
                 demand[recovery_node] = 0
                 current_utility += utils[recovery_node]
-                H = merge_nodes(H, self.root, recovery_node)
+                if draw:
+                    H = merge_nodes(H, self.root, recovery_node, in_place=True)
 
                 # next node to recover
                 node_recovery_index += 1
@@ -114,12 +130,13 @@ class RecoveryEnv:
                 node_recovery_index += 1
 
             # now we merge the node we recovered with our root node
-            H = merge_nodes(H, self.root, recovery_node)
             if draw:
+                H = merge_nodes(H, self.root, recovery_node, in_place=True)
                 plot_graph(H, self.root, folder + '/{0}.png'.format(i), pos)
 
             # increment total utility
             total_utility += current_utility
+            t += 1
 
         if debug:
             print('Total util for this config:', total_utility)
@@ -127,44 +144,65 @@ class RecoveryEnv:
         return total_utility
 
 
-def ratio_heuristic(G, independent_nodes, resources):
+def ratio_order(G, independent_nodes):
     """
-    Given a graph with attributes utility and demand for each node, we calculate the best greedy stepwise
-    recovery based on the ratio of utility to demand. We return the total utility of this recovery.
+    Greedy stepwise recovery order based on the ratio of utility to demand: at every step we recover the
+    node adjacent to the functional nodes with the best util/demand ratio, breaking ties by the lowest node id.
+
+    Each node is pushed onto a heap of candidates once, when it first becomes adjacent to a functional node, so
+    the whole order takes O((V + E) log V).
 
     :param G: networkx graph G, with attributes utility and demand for each node
     :param independent_nodes: independent nodes of graph G
-    :param resources: resources per recovery time step
-    :return: total utility of the ordered recovery sequence, excluding independent nodes
+    :return: recovery order, starting with the independent nodes. Nodes that cannot be reached from the
+    independent nodes are left out.
     """
-    # set starting functional nodes to the given independent nodes
-    functional_nodes = independent_nodes.copy()
     util = nx.get_node_attributes(G, 'util')
     demand = nx.get_node_attributes(G, 'demand')
 
-    print('Connected components', nx.number_connected_components(G))
     # we always start our recovery order with independent nodes
-    ordered = functional_nodes.copy()
-    while len(functional_nodes) is not G.number_of_nodes():
-        # get a list of lists of neighbors for each functional node
-        adj = [list(G.neighbors(func_node)) for func_node in functional_nodes]
-
-        # flatten list
-        adj_nodes = []
-        for node_list in adj:
-            for node in node_list:
-                adj_nodes.append(node)
-
-        # remove functional nodes (already recovered) from possible recovery nodes
-        adj_nodes = list(set(adj_nodes) - set(functional_nodes))
-        
-        # choose the node with the best util/demand ratio
-        ratios = {node: (util[node] / demand[node]) for node in adj_nodes}
+    ordered = independent_nodes.copy()
+
+    # seen holds functional nodes and nodes already pushed onto the heap
+    seen = set(independent_nodes)
+    candidates = []
+
+    def push_neighbors(func_node):
+        for node in G.neighbors(func_node):
+            if node not in seen:
+                seen.add(node)
+                # heapq is a min heap, so we push the negative ratio
+                heapq.heappush(candidates, (-(util[node] / demand[node]), node))
+
+    for func_node in independent_nodes:
+        push_neighbors(func_node)
 
-        ordered.append(max(ratios, key=ratios.get))
+    while candidates:
+        # choose the node with the best util/demand ratio
+        ratio, node = heapq.heappop(candidates)
+        ordered.append(node)
 
         # add node we just recovered to functional nodes
-        functional_nodes.append(ordered[-1])
+        push_neighbors(node)
+
+    return ordered
+
+
+def ratio_heuristic(G, independent_nodes, resources):
+    """
+    Given a graph with attributes utility and demand for each node, we calculate the best greedy stepwise
+    recovery based on the ratio of utility to demand. We return the total utility of this recovery.
+
+    :param G: networkx graph G, with attributes utility and demand for each node
+    :param independent_nodes: independent nodes of graph G
+    :param resources: resources per recovery time step
+    :return: total utility of the ordered recovery sequence, excluding independent nodes
+    :raises ValueError: if a node of G cannot be reached from the independent nodes
+    """
+    print('Connected components', nx.number_connected_components(G))
+    ordered = ratio_order(G, independent_nodes)
+    if len(ordered) != G.number_of_nodes():
+        raise ValueError('Not every node of G can be reached from the independent nodes')
 
     # use recoveryenv to check the total utility of the ordering
     env = RecoveryEnv(G, independent_nodes)
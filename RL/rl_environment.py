@@ -1,8 +1,9 @@
 import networkx as nx
 import copy
-from graph_helper import r_tree, get_root, DP_optimal, plot_graph
+from graph_helper import r_tree, get_root, DP_optimal, plot_graph, resource_schedule, get_functional_nodes
 import math
 import itertools
+from collections import OrderedDict
 import random
 import time
 
@@ -11,11 +12,14 @@ import time
 # of length NumNodes(G), actions are choosing two nodes to recover (an index into the list of all 2-permutations of
 # nodes), and reward is the sum of the utilities of all functional nodes.
 class environment:
-    def __init__(self, G, independent_nodes, resources):
+    def __init__(self, G, independent_nodes, resources, semi_mdp=False, gamma=0.9, reward_cache_size=100000):
         """
         :param G: networkx graph with utility and demand attribute set for each node
         :param independent_nodes: Initial independent nodes of G
-        :param resources: resources per recovery step (used in calculation of maximum rounds)
+        :param resources: resources per recovery step, or a schedule of resources per round (see ResourceSchedule)
+        :param semi_mdp: commit to the first node of an action until it is recovered, see semi_mdp_step
+        :param gamma: discount per round, used to aggregate the rewards of a semi-MDP step
+        :param reward_cache_size: number of recovered sets whose functional utility is kept, see functional_utility
         """
         self.G = G
         self.number_of_nodes = G.number_of_nodes()
@@ -33,15 +37,60 @@ class environment:
         for node in self.independent_nodes:
             self.state[node] = 1
 
-        # max rounds is math.ceil(sum(d) / resources)
+        # max rounds is math.ceil(sum(d) / resources), or the round a schedule covers sum(d)
         self.round = 1
         self.resources = resources
+        self.schedule = resource_schedule(resources)
 
         self.actions_permutations = list(itertools.permutations(range(self.number_of_nodes), 2))
 
         # True when state is vector of 1's
         self.done = False
 
+        self.semi_mdp = semi_mdp
+        self.gamma = gamma
+        # discount to apply to the value of the next state of the last step, gamma^k after a semi-MDP step of k rounds
+        self.discount = gamma
+
+        # the reward only depends on the set of recovered nodes, and the same sets come back across episodes, so the
+        # functional utility of each set is kept in an LRU cache keyed by the bitmask of the set. utils never change.
+        self.total_utility = sum(nx.get_node_attributes(self.G_constant, 'util').values())
+        self.reward_cache = OrderedDict()
+        self.reward_cache_size = reward_cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def functional_utility(self, mask):
+        """
+        Utility of the functional nodes (nodes with a path to an independent node) when the nodes in mask are
+        recovered. Memoized in an LRU cache of at most reward_cache_size sets, counting hits and misses.
+
+        :param mask: bitmask of the recovered nodes, bit x set if self.state[x] == 1
+        :return: (utility of the functional nodes, bitmask of the functional nodes) tuple
+        """
+        if mask in self.reward_cache:
+            self.cache_hits += 1
+            self.reward_cache.move_to_end(mask)
+            return self.reward_cache[mask]
+
+        self.cache_misses += 1
+        utils = nx.get_node_attributes(self.G_constant, 'util')
+        recovered = self.G_constant.subgraph([x for x in range(self.number_of_nodes) if mask >> x & 1])
+        functional_nodes = get_functional_nodes(recovered, self.independent_nodes)
+
+        result = (sum(utils[x] for x in functional_nodes), sum(1 << x for x in functional_nodes))
+        self.reward_cache[mask] = result
+        if len(self.reward_cache) > self.reward_cache_size:
+            self.reward_cache.popitem(last=False)
+
+        return result
+
+    def round_resources(self):
+        """
+        :return: resources available in the current round
+        """
+        return self.schedule.budget(self.round)
+
     def ratio_action(self):
         """
         Best action based on ratio heuristic.
@@ -53,13 +102,10 @@ class environment:
         util = nx.get_node_attributes(self.G_constant, 'util')
 
         stepwise_demand = nx.get_node_attributes(self.G, 'demand')
+        resources = self.round_resources()
 
         start = time.time()
-        functional_nodes = []
-        for node in self.G:
-            for id_node in self.independent_nodes:
-                if nx.has_path(self.G, id_node, node) and id_node != node:
-                    functional_nodes.append(node)
+        functional_nodes = list(get_functional_nodes(self.G, self.independent_nodes))
 
         # possible nodes must be adjacent to either functional or independent nodes
         adjacent_to = functional_nodes + self.independent_nodes
@@ -74,7 +120,7 @@ class environment:
 
                     # if we can fully recover this node at a given time step, then we may start allocating
                     # resources to it's neighbors
-                    if node in stepwise_demand and stepwise_demand[node] < self.resources:
+                    if node in stepwise_demand and stepwise_demand[node] < resources:
                         for neighbor_of_node in self.G_constant.neighbors(node):
                             possible_recovery.append(neighbor_of_node)
 
@@ -108,13 +154,10 @@ class environment:
         # get demand values of our graph
         demand = nx.get_node_attributes(self.G_constant, 'demand')
         stepwise_demand = nx.get_node_attributes(self.G, 'demand')
+        resources = self.round_resources()
 
         start = time.time()
-        functional_nodes = []
-        for node in self.G:
-            for id_node in self.independent_nodes:
-                if nx.has_path(self.G, id_node, node) and id_node != node:
-                    functional_nodes.append(node)
+        functional_nodes = list(get_functional_nodes(self.G, self.independent_nodes))
 
         # possible nodes must be adjacent to either functional or independent nodes
         adjacent_to = functional_nodes + self.independent_nodes
@@ -129,7 +172,7 @@ class environment:
 
                     # if we can fully recover this node at a given time step, then we may start allocating resources
                     # to it's neighbors
-                    if node in stepwise_demand and stepwise_demand[node] < self.resources:
+                    if node in stepwise_demand and stepwise_demand[node] < resources:
                         for neighbor_of_node in self.G_constant.neighbors(node):
                             possible_recovery.append(neighbor_of_node)
 
@@ -180,21 +223,66 @@ class environment:
 
         # get demand values of our graph
         demand = nx.get_node_attributes(self.G_constant, 'demand')
+        resources = self.round_resources()
 
         # if we have extra resources, put them into the second node's allocation
-        if demand[node_pair[0]] < self.resources:
+        if demand[node_pair[0]] < resources:
             true_action[node_pair[0]] = demand[node_pair[0]]
-            true_action[node_pair[1]] = self.resources - demand[node_pair[0]]
+            true_action[node_pair[1]] = resources - demand[node_pair[0]]
 
         # otherwise we just apply maximum resources to the first node
         else:
-            true_action[node_pair[0]] = self.resources
+            true_action[node_pair[0]] = resources
 
         return true_action
 
     def step(self, action, action_is_index=True, debug=False, neg=True):
         """
-        Applies a partition of resources to the graph G
+        Applies a partition of resources to the graph G, or with semi_mdp, keeps applying it until the first node
+        of the action is recovered.
+
+        :param action: index to a specific |V(G)| len vector, where sum(action) == resources at a time step.
+        :param action_is_index: If we wish to test the best config, we only have real action vectors
+        so no need to convert. Usually, we only have the index representation.
+        :param debug: print output data for test runs
+        :param neg: we scale our rewards negatively to not inflate Q-value and preserve more information.
+        :return: state, reward, done
+        """
+        if self.semi_mdp and action_is_index:
+            return self.semi_mdp_step(action, debug, neg)
+
+        self.discount = self.gamma
+        return self.round_step(action, action_is_index, debug, neg)
+
+    def semi_mdp_step(self, action, debug=False, neg=True):
+        """
+        Commit to an action until its first node is recovered (or the episode ends), emitting a single transition.
+        The rounds in between look the same to the agent, so this skips their forward passes and replay entries.
+        The reward is the discounted sum of the k per-round rewards, and self.discount is set to gamma^k so that
+        r + gamma^k * max Q(s') keeps the values of the per-round formulation.
+
+        :param action: index into self.actions_permutations
+        :param debug: print output data for test runs
+        :param neg: we scale our rewards negatively to not inflate Q-value and preserve more information.
+        :return: state, reward, done
+        """
+        node = self.actions_permutations[action][0]
+        total_reward = 0
+        discount = 1
+        while True:
+            state, reward, done = self.round_step(action, True, debug, neg)
+            total_reward += discount * reward
+            discount *= self.gamma
+
+            if done or self.G_constant.nodes[node]['demand'] == 0:
+                break
+
+        self.discount = discount
+        return state, total_reward, done
+
+    def round_step(self, action, action_is_index=True, debug=False, neg=True):
+        """
+        Applies a partition of resources to the graph G for a single round
 
         :param action: index to a specific |V(G)| len vector, where sum(action) == resources at a time step.
         :param action_is_index: If we wish to test the best config, we only have real action vectors
@@ -210,7 +298,6 @@ class environment:
         if debug:
             print('action', action)
 
-        utils = nx.get_node_attributes(self.G_constant, 'util')
         demand = nx.get_node_attributes(self.G_constant, 'demand')
 
         # apply resources to demand vector
@@ -224,21 +311,18 @@ class environment:
         self.G = self.G_constant.subgraph([x if self.state[x] == 1 else None for x in range(len(self.state))])
 
         # count utility only for nodes which have a path to an independent node
-        count_utility = []
-        for node in self.G:
-            for id_node in self.independent_nodes:
-                if nx.has_path(self.G, id_node, node) and id_node != node:
-                    count_utility.append(node)
+        mask = sum(1 << x for x in range(len(self.state)) if self.state[x] == 1)
+        functional_utility, count_utility = self.functional_utility(mask)
 
         if debug:
-            print('count_utility', count_utility)
+            print('count_utility', [x for x in range(len(action)) if count_utility >> x & 1])
 
         # utility at this time step is reward
         # if neg, we subtract potential recoveries from this time step
         if neg:
-            reward = sum([utils[x] if x in count_utility else -1 * utils[x] for x in range(len(action))])
+            reward = 2 * functional_utility - self.total_utility
         else:
-            reward = sum([utils[x] if x in count_utility else 0 for x in range(len(action))])
+            reward = functional_utility
         # convert demand back to dict
         demand = dict((i, demand[i]) for i in range(len(demand)))
 
@@ -249,10 +333,11 @@ class environment:
         if self.state == [1 for x in self.state]:
             self.done = True
 
-        # check if reached round limit, which is ceil(sum(demands of non-independent nodes) / resources per turn)
+        # check if reached round limit, which is ceil(sum(demands of non-independent nodes) / resources per turn), or
+        # the round in which the resource schedule covers them
         independent_node_demand = [self.start_demand[x] for x in self.independent_nodes]
 
-        if self.round >= (math.ceil((sum(self.start_demand.values()) - sum(independent_node_demand)) / self.resources)):
+        if self.round >= self.schedule.round(sum(self.start_demand.values()) - sum(independent_node_demand), 1):
             self.done = True
 
         self.round += 1
@@ -0,0 +1,186 @@
+import json
+import networkx as nx
+import numpy as np
+from graph_helper import get_root
+
+
+# A scenario library is a single binary file holding many recovery instances, so training and evaluation can load
+# thousands of them without parsing GML or instantiating networkx objects. The layout is
+#
+#   magic (8 bytes) | header length (uint64) | JSON header | padding | arrays, each aligned to ALIGNMENT bytes
+#
+# The header records the number of scenarios, their names and the dtype, shape and offset of every array, relative
+# to the first ALIGNMENT boundary after the header. Scenario i owns nodes node_offsets[i]:node_offsets[i + 1] of the
+# util and demand arrays, its CSR row pointers are indptr[node_offsets[i] + i:node_offsets[i + 1] + i + 1] (local to
+# the scenario), its column indices are indices[edge_offsets[i]:edge_offsets[i + 1]] (local node ids), and its
+# independent nodes are independent_nodes[independent_offsets[i]:independent_offsets[i + 1]]. The arrays are memory
+# mapped, so a scenario is only read from disk when it is accessed.
+
+MAGIC = b'PRSCLIB1'
+ALIGNMENT = 64
+ARRAYS = ['node_offsets', 'edge_offsets', 'independent_offsets', 'indptr', 'indices', 'util', 'demand',
+          'independent_nodes']
+
+
+def graph_to_csr(G):
+    """
+    Convert a graph with nodes 0..n-1 and util/demand attributes to arrays.
+
+    :param G: networkx graph, with attributes util and demand for each node
+    :return: (indptr, indices, util, demand) arrays, the neighbors of node v are indices[indptr[v]:indptr[v + 1]]
+    """
+    n = G.number_of_nodes()
+    if set(G.nodes()) != set(range(n)):
+        raise ValueError('Scenario graphs need nodes labeled 0..n-1, see nx.convert_node_labels_to_integers')
+
+    neighbors = [sorted(G.neighbors(v)) for v in range(n)]
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(x) for x in neighbors])
+    indices = np.fromiter((u for x in neighbors for u in x), dtype=np.int32, count=indptr[-1])
+
+    util = nx.get_node_attributes(G, 'util')
+    demand = nx.get_node_attributes(G, 'demand')
+
+    return indptr, indices, np.array([util[v] for v in range(n)]), np.array([demand[v] for v in range(n)])
+
+
+def write_scenario_library(path, graphs, independent_nodes=None, names=None):
+    """
+    Write a list of scenarios to a scenario library file.
+
+    :param path: file to write
+    :param graphs: list of networkx graphs with nodes 0..n-1 and attributes util and demand for each node
+    :param independent_nodes: (optional) list with the independent nodes of each graph, defaults to [get_root(G)]
+    :param names: (optional) list with the name of each graph
+    """
+    if independent_nodes is None:
+        independent_nodes = [[get_root(G)] for G in graphs]
+    if names is None:
+        names = [str(i) for i in range(len(graphs))]
+
+    csr = [graph_to_csr(G) for G in graphs]
+    sizes = np.array([len(x[2]) for x in csr], dtype=np.int64)
+
+    arrays = {
+        'node_offsets': np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64),
+        'edge_offsets': np.concatenate([[0], np.cumsum([len(x[1]) for x in csr])]).astype(np.int64),
+        'independent_offsets': np.concatenate([[0], np.cumsum([len(x) for x in independent_nodes])]).astype(np.int64),
+        'indptr': np.concatenate([x[0] for x in csr] or [np.zeros(0)]).astype(np.int64),
+        'indices': np.concatenate([x[1] for x in csr] or [np.zeros(0)]).astype(np.int32),
+        # keep integer attributes integers, anything else is stored as float64
+        'util': np.concatenate([x[2] for x in csr] or [np.zeros(0)]),
+        'demand': np.concatenate([x[3] for x in csr] or [np.zeros(0)]),
+        'independent_nodes': np.array([v for nodes in independent_nodes for v in nodes], dtype=np.int32),
+    }
+    for key in ['util', 'demand']:
+        dtype = np.int64 if np.issubdtype(arrays[key].dtype, np.integer) else np.float64
+        arrays[key] = arrays[key].astype(dtype)
+
+    # lay the arrays out after the header, we need the header length to know where they start
+    header = {'count': len(graphs), 'names': list(names), 'arrays': {}}
+    offset = 0
+    for key in ARRAYS:
+        header['arrays'][key] = {'dtype': arrays[key].dtype.str, 'shape': list(arrays[key].shape), 'offset': offset}
+        offset += -(-arrays[key].nbytes // ALIGNMENT) * ALIGNMENT
+    encoded = json.dumps(header).encode()
+    start = data_start(len(encoded))
+
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(encoded)).tobytes())
+        f.write(encoded)
+        for key in ARRAYS:
+            f.seek(start + header['arrays'][key]['offset'])
+            f.write(arrays[key].tobytes())
+        f.truncate(start + offset)
+
+
+def data_start(header_length):
+    """
+    :param header_length: length of the JSON header in bytes
+    :return: file offset of the first array
+    """
+    return -(-(len(MAGIC) + 8 + header_length) // ALIGNMENT) * ALIGNMENT
+
+
+class ScenarioLibrary:
+    """
+    Random access to the scenarios of a scenario library file. Opening a library only reads its header, the arrays
+    are memory mapped.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: scenario library file written by write_scenario_library
+        """
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError('{0} is not a scenario library'.format(path))
+            length = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+            header = json.loads(f.read(length).decode())
+
+        self.path = path
+        self.names = header['names']
+        self.count = header['count']
+        self.arrays = {}
+        for key in ARRAYS:
+            spec = header['arrays'][key]
+            if np.prod(spec['shape']) == 0:
+                self.arrays[key] = np.zeros(spec['shape'], dtype=spec['dtype'])
+            else:
+                self.arrays[key] = np.memmap(path, dtype=spec['dtype'], mode='r', shape=tuple(spec['shape']),
+                                             offset=data_start(length) + spec['offset'])
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        """
+        :param i: index of the scenario
+        :return: dict of the indptr, indices, util, demand and independent_nodes arrays of scenario i (read only views)
+        """
+        if not -self.count <= i < self.count:
+            raise IndexError('scenario index out of range')
+        i %= self.count
+
+        a = self.arrays
+        lo, hi = a['node_offsets'][i], a['node_offsets'][i + 1]
+        return {
+            'name': self.names[i],
+            'indptr': a['indptr'][lo + i:hi + i + 1],
+            'indices': a['indices'][a['edge_offsets'][i]:a['edge_offsets'][i + 1]],
+            'util': a['util'][lo:hi],
+            'demand': a['demand'][lo:hi],
+            'independent_nodes': a['independent_nodes'][a['independent_offsets'][i]:a['independent_offsets'][i + 1]],
+        }
+
+    def index(self, name):
+        """
+        :param name: name of a scenario
+        :return: index of the scenario
+        """
+        return self.names.index(name)
+
+    def graph(self, i):
+        """
+        Build the networkx graph of a scenario, for code that needs one.
+
+        :param i: index of the scenario
+        :return: (G, independent nodes) tuple, where each node of G has util/demand/income values
+        """
+        scenario = self[i]
+        indptr, indices = np.asarray(scenario['indptr']), np.asarray(scenario['indices'])
+        n = len(indptr) - 1
+
+        G = nx.Graph()
+        G.add_nodes_from(range(n))
+        rows = np.repeat(np.arange(n), np.diff(indptr))
+        G.add_edges_from(zip(rows.tolist(), indices.tolist()))
+
+        util = dict(enumerate(scenario['util'].tolist()))
+        demand = dict(enumerate(scenario['demand'].tolist()))
+        nx.set_node_attributes(G, name='util', values=util)
+        nx.set_node_attributes(G, name='demand', values=demand)
+        nx.set_node_attributes(G, name='income', values={x: util[x] - demand[x] for x in util})
+
+        return G, scenario['independent_nodes'].tolist()
@@ -0,0 +1,208 @@
+import random
+import time
+import numpy as np
+from graph_helper import r_graph, get_root, node_arrays, evaluate_orders, recovery_bitmasks, resource_schedule, \
+    valid_orders
+
+
+# Tabular baseline between DP_optimal and the DQN, generalizing legacy/mc.py to any graph of up to ~25 nodes to
+# recover. A state is the set of recovered nodes as an integer bitmask (bit i is nodes[i] of recovery_bitmasks), and
+# the values live in a NumPy table indexed by it. Episodes pick the nodes to recover one at a time, among the nodes
+# adjacent to the functional nodes, with the node selection reward of n_environment, so the rewards of an episode add
+# up to the total utility evaluate_orders gives its order. The round of a node of demand 0 also depends on how many
+# nodes of demand 0 were recovered right before it (see ResourceSchedule.round), so a state is the pair (mask, j) of
+# the recovered set and that number, like the states of DP_optimal. The environment is deterministic, so the update is
+# a real time dynamic programming backup: the value of a state moves towards the best reward plus value of its
+# successors. Unvisited states start at an upper bound on their return, so the greedy order converges to the optimal
+# order among those adjacent to the functional nodes.
+class TabularLearner:
+    def __init__(self, G, independent_nodes, resources, alpha=1.0, eps=0.1, seed=None):
+        """
+        :param G: networkx graph with attributes util and demand for each node, nodes labeled 0..n-1
+        :param independent_nodes: already functional nodes of the problem
+        :param resources: resources per round, or a schedule of resources per round (see ResourceSchedule)
+        :param alpha: learning rate, 1 for the exact backup of a deterministic environment
+        :param eps: probability of recovering a random node instead of the greedy one
+        :param seed: random seed for exploration
+        """
+        self.independent_nodes = list(independent_nodes)
+        self.nodes, adj, touches_independent = recovery_bitmasks(G, self.independent_nodes)
+        self.V = len(self.nodes)
+        if self.V > 30:
+            raise ValueError('TabularLearner supports at most 30 nodes to recover, got {0}'.format(self.V))
+
+        util, demand = node_arrays(G)
+        self.util = util
+        self.demand = demand
+        self.bit_util = util[self.nodes].tolist()
+        self.bit_demand = demand[self.nodes].tolist()
+        self.adj = adj
+        self.touches_independent = sum(1 << i for i, touches in enumerate(touches_independent) if touches)
+        self.full = (1 << self.V) - 1
+
+        self.schedule = resource_schedule(resources)
+        self.total_utility = sum(self.bit_util)
+
+        # j goes up to the number of nodes of demand 0, and the last round is latest when they all come last
+        zero_demand = sum(1 for d in self.bit_demand if d == 0)
+        self.runs = zero_demand + 1
+        total_demand = sum(self.bit_demand)
+        self.T = self.schedule.round(total_demand, 1)
+        if zero_demand:
+            self.T = max(self.T, self.schedule.round(total_demand, 0, zero_demand))
+
+        self.alpha = alpha
+        self.eps = eps
+        self.random = random.Random(seed)
+
+        # value of every state (mask, j), NaN until it is first updated
+        self.values = np.full((1 << self.V, self.runs), np.nan, dtype=np.float32)
+        self.values[self.full] = 0
+
+        # (cumulative demand, functional utility, frontier, round) of every state we met
+        self.memo = {}
+
+    def state(self, mask, j=0):
+        """
+        Cumulative demand, utility of the functional nodes (not counting independent nodes), frontier (nodes
+        adjacent to the functional nodes that are not recovered) and round of the last recovered node of a state,
+        memoized.
+
+        :param mask: bitmask of recovered nodes
+        :param j: number of nodes of demand 0 recovered last, in a row
+        :return: (cumulative demand, functional utility, frontier bitmask, round) tuple, round 0 before anything is
+        recovered
+        """
+        if (mask, j) in self.memo:
+            return self.memo[(mask, j)]
+
+        # search from the recovered nodes adjacent to an independent node through recovered nodes
+        functional = 0
+        stack = [i for i in range(self.V) if (self.touches_independent & mask) >> i & 1]
+        for i in stack:
+            functional |= 1 << i
+        while stack:
+            i = stack.pop()
+            grow = self.adj[i] & mask & ~functional
+            functional |= grow
+            stack.extend(j for j in range(self.V) if grow >> j & 1)
+
+        frontier = self.touches_independent
+        cumulative_demand = 0
+        utility = 0
+        for i in range(self.V):
+            if functional >> i & 1:
+                frontier |= self.adj[i]
+                utility += self.bit_util[i]
+            if mask >> i & 1:
+                cumulative_demand += self.bit_demand[i]
+
+        if j > 0:
+            recovery_round = self.schedule.round(cumulative_demand, 0, j)
+        elif mask:
+            recovery_round = self.schedule.round(cumulative_demand, 1)
+        else:
+            recovery_round = 0
+
+        self.memo[(mask, j)] = (cumulative_demand, utility, frontier & ~mask, recovery_round)
+        return self.memo[(mask, j)]
+
+    def bound(self, mask, j=0):
+        """
+        Upper bound on the return of a state: from the round of the state on, every round counts at most the total
+        utility, and the current round gains at most the utility that is not functional yet.
+        """
+        _, utility, _, recovery_round = self.state(mask, j)
+        return (self.T - recovery_round) * self.total_utility + self.total_utility - utility
+
+    def successors(self, mask, j=0):
+        """
+        :param mask: bitmask of recovered nodes
+        :param j: number of nodes of demand 0 recovered last, in a row
+        :return: (actions, next masks, next js, rewards, next values) arrays over the nodes we may recover next (the
+        frontier, or every node that is not recovered when nothing is adjacent to the functional nodes)
+        """
+        _, utility, frontier, recovery_round = self.state(mask, j)
+        if not frontier:
+            frontier = self.full & ~mask
+
+        actions = np.array([i for i in range(self.V) if frontier >> i & 1], dtype=np.int64)
+        next_masks = mask | np.left_shift(1, actions)
+        next_runs = np.where(np.array(self.bit_demand)[actions] == 0, j + 1, 0)
+
+        next_states = [self.state(x, k) for x, k in zip(next_masks.tolist(), next_runs.tolist())]
+        next_utility = np.array([x[1] for x in next_states])
+        rounds = np.array([x[3] for x in next_states])
+        rewards = (rounds - recovery_round) * utility + (next_utility - utility)
+
+        values = self.values[next_masks, next_runs].astype(np.float64)
+        unseen = np.isnan(values)
+        if unseen.any():
+            values[unseen] = [self.bound(x, k) for x, k in zip(next_masks[unseen].tolist(), next_runs[unseen].tolist())]
+
+        return actions, next_masks, next_runs, rewards, values
+
+    def episode(self, explore=True, learn=True):
+        """
+        Recover every node once, updating the values of the states we pass.
+
+        :param explore: take a random action with probability eps
+        :param learn: update the values
+        :return: (total reward, recovery order) tuple, the order as node ids without the independent nodes
+        """
+        mask = 0
+        j = 0
+        total_reward = 0
+        order = []
+        while mask != self.full:
+            actions, next_masks, next_runs, rewards, values = self.successors(mask, j)
+            targets = rewards + values
+            best = int(np.argmax(targets))
+
+            if learn:
+                value = self.values[mask, j]
+                value = self.bound(mask, j) if np.isnan(value) else value
+                self.values[mask, j] = value + self.alpha * (targets[best] - value)
+
+            k = self.random.randrange(len(actions)) if explore and self.random.random() < self.eps else best
+            total_reward += rewards[k].item()
+            order.append(self.nodes[actions[k]])
+            mask = next_masks[k].item()
+            j = next_runs[k].item()
+
+        return total_reward, order
+
+    def train(self, episodes):
+        """
+        :param episodes: number of training episodes
+        :return: list with the total reward of every episode
+        """
+        return [self.episode()[0] for _ in range(episodes)]
+
+    def greedy(self):
+        """
+        :return: (total utility, recovery config) tuple of the greedy order, like DP_optimal
+        """
+        total_reward, order = self.episode(explore=False, learn=False)
+        return total_reward, self.independent_nodes + order
+
+
+def main():
+    num_nodes = 10
+    resources = 1
+    G = r_graph(num_nodes, 0.3, seed=3)
+    root = get_root(G)
+    learner = TabularLearner(G, [root], resources, seed=0)
+
+    start = time.time()
+    learner.train(2000)
+    print('Tabular greedy', learner.greedy(), 'time:', time.time() - start)
+    print('States visited', len(learner.memo), 'of', learner.values.size)
+
+    util, demand = node_arrays(G)
+    orders = np.array([list(order) for order in valid_orders(G, [root])])
+    print('Best valid order', evaluate_orders(orders, util, demand, resources).max())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+import hashlib
+import multiprocessing
+import os
+import re
+import networkx as nx
+import numpy as np
+
+
+# Fast loading of GML topologies (e.g. the Topology Zoo). We only parse the nodes and edges, which is all recovery
+# needs, and cache them next to the source file in a small binary file: an int64 header (format version, size and
+# mtime of the source, number of nodes, number of edges, multigraph and directed flags), the sha1 of the source and
+# the int32 edge array. The cache is keyed on the size and mtime of the source, and on its sha1 when those changed
+# (e.g. after a checkout), so editing a GML file invalidates its cache.
+
+CACHE_SUFFIX = '.topology'
+CACHE_VERSION = 1
+
+# a GML token is a quoted string, a bracket, or anything else up to whitespace or a bracket
+_token = re.compile(r'"[^"]*"|\[|\]|[^\s\[\]"]+')
+
+
+def parse_gml(text):
+    """
+    Parse the nodes and edges of a GML graph, ignoring every other attribute. Nodes are numbered in the order they
+    appear in the file, the way nx.read_gml followed by nx.convert_node_labels_to_integers numbers them, and edges are
+    matched to nodes by id (so duplicate labels are fine).
+
+    :param text: contents of a GML file
+    :return: (number of nodes, (E, 2) int array of edges, multigraph, directed)
+    """
+    tokens = _token.findall(text)
+    ids = {}
+    sources, targets = [], []
+    flags = {'multigraph': 0, 'directed': 0}
+
+    # depth 1 is inside graph [ ], depth 2 inside a node or edge
+    depth = 0
+    record = None
+    fields = {}
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token == '[':
+            depth += 1
+        elif token == ']':
+            depth -= 1
+            if depth == 1 and record is not None:
+                if record == 'node':
+                    ids[int(fields['id'])] = len(ids)
+                else:
+                    sources.append(int(fields['source']))
+                    targets.append(int(fields['target']))
+                record = None
+        elif depth == 1 and token in ('node', 'edge') and i + 1 < len(tokens) and tokens[i + 1] == '[':
+            record = token
+            fields = {}
+        elif depth == 1 and token in flags and i + 1 < len(tokens):
+            flags[token] = int(tokens[i + 1])
+            i += 1
+        elif depth == 2 and record is not None and i + 1 < len(tokens) and tokens[i + 1] not in ('[', ']'):
+            fields[token] = tokens[i + 1]
+            i += 1
+        i += 1
+
+    edges = np.array([[ids[s], ids[t]] for s, t in zip(sources, targets)], dtype=np.int32).reshape(-1, 2)
+
+    return len(ids), edges, bool(flags['multigraph']), bool(flags['directed'])
+
+
+def _file_key(path):
+    stat = os.stat(path)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def _file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _read_cache(cache_path):
+    with open(cache_path, 'rb') as f:
+        header = np.fromfile(f, dtype=np.int64, count=7)
+        if len(header) != 7 or header[0] != CACHE_VERSION:
+            raise ValueError('unknown topology cache format')
+        digest = f.read(20).hex()
+        edges = np.fromfile(f, dtype=np.int32, count=2 * header[4]).reshape(-1, 2)
+        if len(edges) != header[4]:
+            raise ValueError('truncated topology cache')
+
+    return header, digest, edges
+
+
+def _write_cache(cache_path, key, digest, n, edges, multigraph, directed):
+    header = np.array([CACHE_VERSION, key[0], key[1], n, len(edges), multigraph, directed], dtype=np.int64)
+    try:
+        with open(cache_path, 'wb') as f:
+            f.write(header.tobytes())
+            f.write(bytes.fromhex(digest))
+            f.write(np.ascontiguousarray(edges, dtype=np.int32).tobytes())
+    except OSError:
+        # read only directory, just don't cache
+        pass
+
+
+def load_topology(path, cache=True):
+    """
+    Load the nodes and edges of a GML file, from its cache when it is up to date.
+
+    :param path: GML file
+    :param cache: read and write the cache next to the source
+    :return: (number of nodes, (E, 2) int array of edges, multigraph, directed)
+    """
+    cache_path = path + CACHE_SUFFIX
+    key = _file_key(path)
+
+    if cache and os.path.exists(cache_path):
+        try:
+            header, digest, edges = _read_cache(cache_path)
+            n, multigraph, directed = int(header[3]), bool(header[5]), bool(header[6])
+            if np.array_equal(header[1:3], key):
+                return n, edges, multigraph, directed
+            if digest == _file_hash(path):
+                # same contents with a new mtime, refresh the key
+                _write_cache(cache_path, key, digest, n, edges, multigraph, directed)
+                return n, edges, multigraph, directed
+        except (OSError, ValueError):
+            # unreadable cache, parse the source again
+            pass
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    n, edges, multigraph, directed = parse_gml(data.decode('utf-8', errors='replace'))
+
+    if cache:
+        _write_cache(cache_path, key, hashlib.sha1(data).hexdigest(), n, edges, multigraph, directed)
+
+    return n, edges, multigraph, directed
+
+
+def topology_graph(n, edges, multigraph=False, directed=False):
+    """
+    Build the networkx graph of a topology, with nodes 0..n-1 and edges in file order.
+
+    :return: nx.Graph, or nx.MultiGraph / nx.DiGraph / nx.MultiDiGraph following the GML flags like nx.read_gml
+    """
+    if multigraph:
+        G = nx.MultiDiGraph() if directed else nx.MultiGraph()
+    else:
+        G = nx.DiGraph() if directed else nx.Graph()
+    G.add_nodes_from(range(n))
+    G.add_edges_from(edges.tolist())
+
+    return G
+
+
+def read_topology(path, cache=True):
+    """
+    nx.read_gml(path) followed by nx.convert_node_labels_to_integers, without the node and edge attributes.
+
+    :param path: GML file
+    :param cache: read and write the cache next to the source
+    :return: networkx graph
+    """
+    return topology_graph(*load_topology(path, cache))
+
+
+def _load_topology_task(path):
+    try:
+        return path, load_topology(path)
+    except (OSError, KeyError, ValueError) as e:
+        print('Could not load {0}: {1}'.format(path, e))
+        return path, None
+
+
+def load_topology_directory(directory, processes=None):
+    """
+    Load every GML file of a directory (e.g. the whole Topology Zoo) in parallel, filling the caches as we go.
+
+    :param directory: directory of GML files
+    :param processes: number of worker processes, defaults to the number of cpus
+    :return: dict of file name (without .gml) to networkx graph, files we could not parse are left out
+    """
+    paths = sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.gml'))
+
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.map(_load_topology_task, paths)
+
+    return {os.path.basename(path)[:-len('.gml')]: topology_graph(*topology)
+            for path, topology in results if topology is not None}
@@ -1,8 +1,15 @@
 import networkx as nx
 import numpy as np
 import matplotlib.pyplot as plt
-from tree_recovery import get_root, merge_nodes, r_tree, plot_graph, calc_height, simulate_tree_recovery, plot_bar_x, par_max_util_configs, prune_map
+from tree_recovery import get_root, merge_nodes, r_tree, plot_graph, calc_height, simulate_tree_recovery, plot_bar_x, par_max_util_configs, prune_map, \
+    node_arrays, evaluate_orders, valid_orders, prefix_configs, resource_schedule
 import multiprocessing
+from multiprocessing import shared_memory
+import itertools
+import atexit
+import random
+import io
+import contextlib
 
 # TODO:
 # 1. Test multiple independent nodes for optimality (we are only comparing against U-D heuristic
@@ -23,12 +30,19 @@ class RecoveryEnv:
         '''
         Recover our network with the order given.
         :param order: |network| len list with order of nodes to recover
-        :param resources: resources per time step (assumed constant)
+        :param resources: resources per time step, or a schedule of resources per round (see ResourceSchedule)
         :param include_independent_nodes: include recovering independent nodes in the total_utility count
         :param debug: print step by step recovery order to check if correct
         :param draw: draw graph at each step of recovery
         :return: total utility
         '''
+        if not debug and not draw:
+            # the closed form gives the same total utility, the round by round walk below is only needed to
+            # print or plot every step
+            util, demand = node_arrays(self.network)
+            start = 0 if include_independent_nodes else len(self.independent_nodes)
+            return evaluate_orders(order[start:], util, demand, resources)
+
         demand = nx.get_node_attributes(self.network, 'demand')
         utils = nx.get_node_attributes(self.network, 'util')
 
@@ -51,11 +65,16 @@ class RecoveryEnv:
         total_utility = 0
         remaining_resources = 0
 
+        # round we are in, counting from 1, which sets the resources we get when we run out
+        schedule = resource_schedule(resources)
+        t = 1
+
         if not include_independent_nodes:
             node_recovery_index += len(self.independent_nodes)
 
         # keep a copy of our graph to plot change over time/ recovery order more intuitively
-        H = self.network.copy()
+        if draw:
+            H = self.network.copy()
 
         # iteration counter for saving intermediate graphs
         i = 0
@@ -73,18 +92,19 @@ class RecoveryEnv:
                 print('Recovering node: ', recovery_node, [utils[recovery_node], demand[recovery_node]])
 
             # Use all remaining resources if we had some from the previous turn, otherwise
-            # the amount of resources we are allocated this turn is our constant resource income
+            # the amount of resources we are allocated this turn is our resource income for round t
             if remaining_resources != 0:
                 resources_this_turn = remaining_resources
                 remaining_resources = 0
             else:
-                resources_this_turn = resources
+                resources_this_turn = schedule.budget(t)
 
             # if our demand is greater than the resources at this time step, apply all resources
             # and continue to the next step
             if demand[recovery_node] > resources_this_turn:
                 demand[recovery_node] -= resources_this_turn
                 total_utility += current_utility
+                t += 1
                 continue
 
             # If demand < supply this turn, we don't increment total utility yet because we still have resources leftover
@@ -93,7 +113,8 @@ class RecoveryEnv:
                 remaining_resources = resources_this_turn - demand[recovery_node]
                 demand[recovery_node] = 0
                 current_utility += utils[recovery_node]
-                H = merge_nodes(H, self.root, recovery_node)
+                if draw:
+                    H = merge_nodes(H, self.root, recovery_node, in_place=True)
 
                 # next node to recover
                 node_recovery_index += 1
@@ -115,36 +136,39 @@ class RecoveryEnv:
                 node_recovery_index += 1
 
             # now we merge the node we recovered with our root node
-            H = merge_nodes(H, self.root, recovery_node)
             if draw:
+                H = merge_nodes(H, self.root, recovery_node, in_place=True)
                 plot_graph(H, self.root, folder + '/{0}.png'.format(i), pos)
 
             # increment total utility
             total_utility += current_utility
+            t += 1
 
         if debug:
             print('Total util for this config:', total_utility)
 
         return total_utility
 
-    def optimal(self, resources, include_independent_nodes=False):
+    def optimal(self, resources, include_independent_nodes=False, chunk_size=100000):
         '''
         Returns the optimal total utility for self.network. May not be unique.
-        :param resources: resources per time step
+        :param resources: resources per time step, or a schedule of resources per round (see ResourceSchedule)
         :param include_independent_nodes: include recovering independent nodes in the total_utility count
+        :param chunk_size: number of configs scored at once, bounds the memory of the batch
         :return: optimal total utility over _ceiling{sum(demand) / resources} time steps
         '''
-        # get the possible maximum utility configs
-        configs = par_get_configs(self.network, self.independent_nodes)
-        max_total_utility = 0; max_config = None
-
-        # check for greatest
-        for config in configs:
-            config_util = self.recover(config, resources, include_independent_nodes)
-
-            if config_util > max_total_utility:
+        max_total_utility = 0; max_config = None; max_index = None
+
+        # the workers enumerate the possible maximum utility configs of one prefix task at a time, score them a
+        # chunk at a time with the closed form of recover and send back only the best. Tasks finish out of order,
+        # so ties go to the lowest task index to return the same config as a sequential scan.
+        for index, config_util, config in par_map_configs(self.network, self.independent_nodes, 'score',
+                                                           (resources, include_independent_nodes, chunk_size)):
+            if config_util > max_total_utility or \
+                    (config_util == max_total_utility and max_index is not None and index < max_index):
                 max_config = config
                 max_total_utility = config_util
+                max_index = index
 
         return max_total_utility, max_config
 
@@ -167,6 +191,197 @@ def deviation_from_optimal(nodes, resources, height=None):
 
     return (G.optimal(resources)[0], simulate_tree_recovery(tree, resources, root))
 
+def schedule_deviations(trials=1000, max_nodes=9, max_demand=3, seed=None):
+    '''
+    Check the closed form of RecoveryEnv.recover against its round by round walk (debug=True) on random trees, orders
+    and resource schedules. Demands and budgets are drawn with zeros so that nodes of demand 0 meet rounds without
+    resources, where the two are easiest to get out of step.
+
+    :param trials: number of random instances
+    :param max_nodes: largest number of nodes of a tree
+    :param max_demand: largest demand of a node
+    :param seed: random seed
+    :return: list of (budgets, demands in recovery order, walk total, closed form total) of the instances where the
+    two differ, empty if they agree
+    '''
+    rng = random.Random(seed)
+    deviations = []
+    for trial in range(trials):
+        tree = nx.random_tree(rng.randint(2, max_nodes), seed=rng.randrange(2 ** 32))
+        for node in tree.nodes:
+            tree.nodes[node]['util'] = rng.randint(1, 4)
+            tree.nodes[node]['demand'] = rng.choice([0, 0] + list(range(1, max_demand + 1)))
+        budgets = [rng.choice([0, 0, 1, 2]) for _ in range(rng.randint(0, 4))] + [rng.randint(1, 3)]
+
+        root = get_root(tree)
+        order = [root] + rng.sample([node for node in tree.nodes if node != root], tree.number_of_nodes() - 1)
+        env = RecoveryEnv(tree, [root])
+        with contextlib.redirect_stdout(io.StringIO()):
+            walk = env.recover(order, budgets, debug=True)
+        closed_form = env.recover(order, budgets)
+
+        if walk != closed_form:
+            demands = [tree.nodes[node]['demand'] for node in order]
+            deviations.append((budgets, demands, walk, closed_form))
+
+    return deviations
+
+# Persistent pool enumerating configs, created on first use and shared by every RecoveryEnv
+_config_pool = None
+# Ids the problems published to the pool, so that workers only load a problem when it changes
+_config_problem_ids = itertools.count()
+# Problem (graph, arrays, independent nodes and schedule) a worker has last loaded, filled in by _load_config_problem
+_config_worker = {}
+
+def _close_config_pool():
+    global _config_pool
+    if _config_pool is not None:
+        _config_pool.close()
+        _config_pool.join()
+        _config_pool = None
+
+def _get_config_pool():
+    '''
+    Return the persistent config pool, starting it (and registering its shutdown at exit) the first time.
+    '''
+    global _config_pool
+    if _config_pool is None:
+        _config_pool = multiprocessing.Pool()
+        atexit.register(_close_config_pool)
+
+    return _config_pool
+
+def _publish_config_problem(G, independent_nodes, mode, args):
+    '''
+    Copy a problem into one shared memory block, so that it reaches the workers once instead of with every task:
+    the edge array, the util and demand arrays, the independent nodes and the budgets of the resource schedule.
+
+    :param G: networkx graph
+    :param independent_nodes: List of independent nodes
+    :param mode: 'configs' or 'score', see par_map_configs
+    :param args: (resources, include_independent_nodes, chunk_size) tuple in 'score' mode
+    :return: (shared memory block, (problem id, block name, layout, mode, task args)) where layout lists the
+    (dtype, shape, offset) of every array in the block and task args is (include_independent_nodes, chunk_size)
+    '''
+    resources, task_args = (args[0], args[1:]) if mode == 'score' else (None, None)
+    util, demand = node_arrays(G)
+    edges = np.array(list(G.edges()), dtype=np.int64).reshape(-1, 2)
+    budgets = resource_schedule(resources).budgets if resources is not None else np.zeros(0)
+    arrays = [edges, util, demand, np.array(independent_nodes, dtype=np.int64), budgets]
+
+    layout = []; offset = 0
+    for array in arrays:
+        layout.append((array.dtype.str, array.shape, offset))
+        offset += array.nbytes
+
+    block = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for array, (dtype, shape, start) in zip(arrays, layout):
+        np.ndarray(shape, dtype, buffer=block.buf, offset=start)[...] = array
+
+    return block, (next(_config_problem_ids), block.name, layout, mode, task_args)
+
+def _load_config_problem(problem):
+    '''
+    Load a published problem into _config_worker, unless the worker already has it. The arrays are copied out of the
+    shared memory block so the worker doesn't hold on to it.
+
+    :param problem: (problem id, block name, layout, mode, task args) tuple, see _publish_config_problem
+    '''
+    problem_id, name, layout = problem[:3]
+    if _config_worker.get('problem_id') == problem_id:
+        return
+
+    block = shared_memory.SharedMemory(name=name)
+    edges, util, demand, independent_nodes, budgets = \
+        [np.ndarray(shape, dtype, buffer=block.buf, offset=start).copy() for dtype, shape, start in layout]
+    block.close()
+
+    G = nx.Graph()
+    G.add_nodes_from(range(len(util)))
+    G.add_edges_from(edges.tolist())
+
+    _config_worker['problem_id'] = problem_id
+    _config_worker['G'] = G
+    _config_worker['util'] = util
+    _config_worker['demand'] = demand
+    _config_worker['independent_nodes'] = independent_nodes.tolist()
+    _config_worker['schedule'] = resource_schedule(budgets) if len(budgets) else None
+
+def _config_task(task):
+    '''
+    Pool task enumerating every valid config that starts with a given prefix. The problem itself is published once
+    in shared memory (see _publish_config_problem), a task only carries its handle.
+
+    :param task: (index, problem, prefix) tuple, where problem is the handle of the published problem
+    :return: (index, int array of configs) in 'configs' mode, (index, utility, config) of the best config in 'score'
+    mode (config is None if there are no configs)
+    '''
+    index, problem, prefix = task
+    mode, args = problem[3:]
+    _load_config_problem(problem)
+    G = _config_worker['G']
+    util = _config_worker['util']
+    demand = _config_worker['demand']
+    independent_nodes = _config_worker['independent_nodes']
+    width = len(util) - len(independent_nodes)
+
+    if mode == 'configs':
+        empty = np.zeros((0, len(util)), dtype=np.int64)
+        return index, np.concatenate([empty] + list(prefix_configs(G, independent_nodes, prefix,
+                                                                   include_independent_nodes=True)))
+
+    include_independent_nodes, chunk_size = args
+    resources = _config_worker['schedule']
+    best_util = 0; best_config = None
+    for chunk in prefix_configs(G, independent_nodes, prefix, chunk_size, include_independent_nodes):
+        config_utils = evaluate_orders(chunk, util, demand, resources)
+
+        best = int(np.argmax(config_utils))
+        if best_config is None or config_utils[best] > best_util:
+            best_util = config_utils[best].item()
+            best_config = list(independent_nodes) + chunk[best, chunk.shape[1] - width:].tolist()
+
+    return index, best_util, best_config
+
+def par_map_configs(G, independent_nodes, mode='configs', args=None, prefix_length=2):
+    '''
+    Enumerate valid configurations on the persistent pool, streaming back the result of one task at a time. Every
+    task handles the valid configurations starting with one valid prefix, so invalid orders are never generated and
+    only the configurations of the tasks in flight are held in memory. The graph is sent to the workers as compact
+    arrays published once in shared memory, never the networkx graph, and a task only carries its handle and
+    prefix. Needs to be at high namespace level.
+
+    :param G: networkx graph
+    :param independent_nodes: List of independent nodes
+    :param mode: 'configs' to get every configuration back, 'score' to get only the best configuration of each task
+    :param args: (resources, include_independent_nodes, chunk_size) tuple in 'score' mode
+    :param prefix_length: number of non independent nodes fixed by each task
+    :return: generator of task results (see _config_task), in order of completion
+    '''
+    block, problem = _publish_config_problem(G, independent_nodes, mode, args)
+
+    try:
+        prefix_length = min(prefix_length, G.number_of_nodes() - len(independent_nodes))
+        tasks = ((index, problem, prefix)
+                 for index, prefix in enumerate(valid_orders(G, independent_nodes, length=prefix_length)))
+
+        for result in _get_config_pool().imap_unordered(_config_task, tasks):
+            yield result
+    finally:
+        block.close()
+        block.unlink()
+
+def par_iter_configs(G, independent_nodes, prefix_length=2):
+    '''
+    Generate valid configurations in a parallel fashion, one prefix task at a time. Needs to be at high namespace level.
+
+    :param G: networkx graph
+    :param independent_nodes: List of independent nodes
+    :param prefix_length: number of non independent nodes fixed by each task
+    :return: generator of (task index, int array of configurations) tuples, in order of completion
+    '''
+    return par_map_configs(G, independent_nodes, 'configs', prefix_length=prefix_length)
+
 def par_get_configs(G, independent_nodes):
     '''
     Generate and prune configurations in a parallel fashion. Needs to be at high namespace level.
@@ -175,11 +390,9 @@ def par_get_configs(G, independent_nodes):
     :param independent_nodes: List of independent nodes
     :return: list of pruned configurations
     '''
-    all_permutations = par_max_util_configs(G, independent_nodes)
-    pool = multiprocessing.Pool()
-    pruned = pool.map(prune_map, all_permutations)
-
-    pruned = [list(config) for config in pruned if config != []]
-    pool.close()
+    # put the tasks back in order so configurations come out in lexicographic order
+    pruned = []
+    for index, configs in sorted(par_iter_configs(G, independent_nodes), key=lambda task: task[0]):
+        pruned.extend(configs.tolist())
 
     return pruned
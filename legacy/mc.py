@@ -1,5 +1,6 @@
 from __future__ import print_function, division
 from builtins import range, input
+from functools import lru_cache
 
 import networkx as nx
 import numpy as np
@@ -15,6 +16,33 @@ for node in nodes:
 
 edges = (("s","a"), ("a","c"), ("s","b"), ("b","d"), ("d","e"))
 
+# bitmask of the neighbors of every node, bit i is nodes[i] (as in Environment.get_state)
+neighbor_masks = [0] * LENGTH
+for edge in edges:
+    neighbor_masks[node_ids[edge[0]]] |= 1 << node_ids[edge[1]]
+    neighbor_masks[node_ids[edge[1]]] |= 1 << node_ids[edge[0]]
+
+# reward of a state and bitmask of the active nodes connected to "s" (0 if "s" is not active).
+# the reward only depends on the state and the same states come back in every game, so it is
+# cached, see connected_reward.cache_info() for the hits and misses
+@lru_cache(maxsize=2**LENGTH)
+def connected_reward(state):
+    source = 1 << node_ids["s"]
+    if not state & source:
+        return 0, 0
+
+    reachable = source
+    frontier = source
+    while frontier:
+        grow = 0
+        for i in range(LENGTH):
+            if frontier >> i & 1:
+                grow |= neighbor_masks[i]
+        frontier = grow & state & ~reachable
+        reachable |= frontier
+
+    return float(bin(reachable).count("1")), reachable
+
 class Agent:
   def __init__(self, eps=0.17, alpha=0.5):
     self.eps = eps # probability of choosing random action instead of greedy
@@ -109,21 +137,7 @@ class Environment:
         return LENGTH
     
     def calc_reward(self):
-        if self.network[node_ids["s"]] == True: #for "s"
-            G = nx.Graph()
-            for node in nodes:
-                if self.network[node_ids[node]] == True:
-                    G.add_node(node)
-            for edge in edges:
-                if self.network[node_ids[edge[0]]] == True and self.network[node_ids[edge[1]]] == True:
-                    G.add_edge(*edge)
-                elif self.network[node_ids[edge[1]]] == True and self.network[node_ids[edge[0]]] == True:
-                    G.add_edge(*edge)
-            for component in nx.connected_components(G):
-                if "s" in component:
-                    return float(len(component))
-        else:
-            return 0
+        return connected_reward(self.get_state())[0]
 
 
     def get_state(self):
@@ -10,27 +10,41 @@ def all_zeros(arr):
 
     return zeros
 
-# Recursively generate all the possible partitions with [total] objects
-# and [groups] partitions. Returns a list of list of integers.
+# Lazily generate every partition of [total] objects into [groups] partitions
+# (stars and bars), as tuples in the order possible_allocs lists them. With
+# [bounds], partition i gets at most bounds[i] objects, and branches that cannot
+# place all the objects are cut before they are explored.
+def allocations(groups, total, bounds=None):
+    if bounds is None:
+        bounds = [total] * groups
+
+    # capacity[i] is the most objects partitions i, i + 1, ... can take
+    capacity = [0] * (groups + 1)
+    for i in range(groups - 1, -1, -1):
+        capacity[i] = capacity[i + 1] + min(bounds[i], total)
+
+    if groups == 0 or capacity[0] < total:
+        return
+
+    alloc = [0] * groups
+
+    def fill(i, left):
+        if i == groups - 1:
+            alloc[i] = left
+            yield tuple(alloc)
+            return
+
+        # leave no more than the remaining partitions can take
+        for x in range(max(0, left - capacity[i + 1]), min(bounds[i], left) + 1):
+            alloc[i] = x
+            yield from fill(i + 1, left - x)
+
+    yield from fill(0, total)
+
+# Generate all the possible partitions with [total] objects and [groups]
+# partitions. Returns a list of list of integers.
 def possible_allocs(groups, total):
-    if (groups == 1):
-        return [[total]];
-    else:
-        nums = range(total + 1);
-        # looping through all values for one of the partitions.
-        container1 = [];
-        for i in nums:
-            # recursive step - generate all combinations without the first 
-            # partition
-            subset = possible_allocs(groups - 1, total - i);
-            # append the first partition onto each element of this list
-            container2 = [];
-            for l in subset:
-                container2 += [([i] + l)];
-            container1 += [container2];
-        # Flatten just takes a list of lists, and extract everything in each
-        # list and mesh everything together.
-        return [item for sublist in container1 for item in sublist];
+    return [list(alloc) for alloc in allocations(groups, total)]
 
 # Given a recovery cost vec and configuration, returns true if we don't overapply resources
 # ie. when we apply [3, 0, 0] to the recovery cost [2, 3, 5], returns false because 3 > 2 at v1.
@@ -60,87 +74,95 @@ def non_neg(recovery_costs, config):
 
     return True
 
-# Return a new recovery_cost vector, with the config vector applied. Assumes the 
+# Return a new recovery_cost vector, with the config vector applied. Assumes the
 # config vector is valid for the current recovery_cost (i.e. non_neg is true)
 def apply_config(recovery_cost, config):
     return [recovery_cost[i] - config[i] for i in range(len(config))]
 
-# Helper class for creating a tree of possible recovery outcomes
-class Node:
-    def __init__(self, vec):
-        self.vec = vec
-        self.children = []
-
-# wrapper for root recursion
-def iterate_over_failures(recovery_costs, r):
-    all_configs = iterate_over_failures_helper(recovery_costs, r)
-    root = Node(recovery_costs)
-    root.children = all_configs
+# Remaining costs after applying a config, with over-applied resources (only possible
+# on the last config of a sequence) clamped to zero
+def clamp(recovery_cost):
+    return tuple(max(c, 0) for c in recovery_cost)
+
+# Lazily generate the configs of [r] resources that pass non_neg for the recovery
+# costs, without generating the ones it prunes. Either no node gets more than its
+# cost, or, when the remaining costs add up to at most r, every node is finished
+# and the rest of the resources go anywhere.
+def valid_configs(recovery_costs, r):
+    total = sum(recovery_costs)
+    if total > r:
+        for config in allocations(len(recovery_costs), r, recovery_costs):
+            yield config
+        return
 
-    return root
+    for extra in allocations(len(recovery_costs), r - total):
+        yield tuple(c + e for c, e in zip(recovery_costs, extra))
 
-# Returns a recursively defined tree of possible, pruned recovery configurations
-def iterate_over_failures_helper(recovery_costs, r):
+# Lazily generate every recovery path (list of configs) that recovers every node,
+# depth first in the order root_to_leaves used to list them. Only the current path
+# is kept, and it is only copied when it is complete.
+def recovery_paths(recovery_costs, r):
+    recovery_costs = clamp(recovery_costs)
     if all_zeros(recovery_costs):
-        leaf = Node(-1)
-        leaf.children = []
-        return [leaf]
-
-    # all recovery configurations, not all my be possible
-    recovery_configurations = possible_allocs(len(recovery_costs), r)
-    
-    # we prune the configurations to only those that don't over allocate resources
-    pruned_configs = [config for config in recovery_configurations if non_neg(recovery_costs, config)]
-    #print(pruned_configs)
-
-    children = []
-    # now descend down the recursive tree for each pruned config
-    for config in pruned_configs:
-        # apply config, we know it will be a valid application since it is a pruned config
-        new_recovery_cost = apply_config(recovery_costs, config)
-        config_node = Node(config)
-        children.append(config_node)
-        config_node.children = iterate_over_failures_helper(new_recovery_cost, r)
-        #print(config_node.children)
-
-    return children
-
-# print out all possible paths from a root to every leaf node
-# dfs with backtracking
-def root_to_leaves(root):
+        return
+
+    path = []
+
+    def descend(costs):
+        for config in valid_configs(costs, r):
+            path.append(list(config))
+            new_recovery_cost = clamp(apply_config(costs, config))
+            if all_zeros(new_recovery_cost):
+                yield list(path)
+            else:
+                yield from descend(new_recovery_cost)
+            path.pop()
+
+    yield from descend(recovery_costs)
+
+# print out all possible paths from the recovery costs to full recovery
+def root_to_leaves(recovery_costs, r):
     start = time.time()
-    # so we don't print out root, we handle it separately
-    all_paths = []
-    for child in root.children:
-        recurse(child, [], 0, all_paths)
+    all_paths = list(recovery_paths(recovery_costs, r))
 
     end = time.time()
     print(end - start)
     return all_paths
 
-# recursive helper function 
-def recurse(node, path, pathLen, all_paths):
-    if node.vec is -1:
-        return
-
-    # python has no implicit pass by value, so we emulate it by creating 
-    # a new, identical list
-    newPath = path[:]
-    newPath.append(node.vec)
-    pathLen += 1
-
-    if len(node.children) == 1 and node.children[0].vec == -1:
-        temp = []
-        for j in range(pathLen):
-            #print(newPath[j], end=' ')
-            temp.append(newPath[j])
-        #print()
-        # take advantage of python 'pass by reference' to add paths to our current
-        # list of all paths
-        all_paths.append(temp)
-        return
-
-    else:
-        for child in node.children:
-            recurse(child, newPath, pathLen, all_paths)
-        return
\ No newline at end of file
+# Best recovery path by dynamic programming over the remaining cost vectors.
+# Many paths reach the same remaining costs, and the rest of a path only depends
+# on them, so each remaining cost vector is solved once (memoized), instead of
+# once per path leading to it. [utility] maps a remaining cost vector to the
+# utility of the system at a time step, which only depends on which nodes are
+# recovered (cost 0). Returns (max total utility, best path) where the total is
+# the sum of the utility after every config of the path.
+def best_path(recovery_costs, r, utility):
+    best = {}
+
+    def solve(costs):
+        if all_zeros(costs):
+            return 0
+        if costs in best:
+            return best[costs][0]
+
+        best_value, best_config = None, None
+        for config in valid_configs(costs, r):
+            new_recovery_cost = clamp(apply_config(costs, config))
+            value = utility(new_recovery_cost) + solve(new_recovery_cost)
+            if best_value is None or value > best_value:
+                best_value, best_config = value, config
+
+        best[costs] = (best_value, best_config)
+        return best_value
+
+    costs = clamp(recovery_costs)
+    total = solve(costs)
+
+    # walk the best configs from the start to get the path
+    path = []
+    while not all_zeros(costs):
+        config = best[costs][1]
+        path.append(list(config))
+        costs = clamp(apply_config(costs, config))
+
+    return total, path
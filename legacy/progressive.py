@@ -6,6 +6,8 @@ from random import randint
 import time as tfunc
 import numpy as np
 
+from recover_graph import largest_component_sizes
+
 #---------------------------
 def savegml(G):
     nx.write_graphml(G, "./graph.graphml")
@@ -14,10 +16,10 @@ def savegml(G):
 
 
 #generate the sample graph
-def generate_graph():
+def generate_graph(draw=True):
     G = nx.Graph()
 
-    utils = {} 
+    utils = {}
     caps = {}
     rcv_amts = {}
 
@@ -48,73 +50,106 @@ def generate_graph():
     # Nodes have utility, capacity and current amount which the node recieve
     # for recovery
     # in this simulation, im not using utility though
-    nx.set_node_attributes(G, "util", 1.0)
-    nx.set_node_attributes(G, "cap", caps)
-    nx.set_node_attributes(G, "rcv_amt", rcv_amts)
+    nx.set_node_attributes(G, name="util", values=utils)
+    nx.set_node_attributes(G, name="cap", values=caps)
+    nx.set_node_attributes(G, name="rcv_amt", values=rcv_amts)
 
-    nx.draw(G,with_labels=True)
-    plt.show()
+    if draw:
+        nx.draw(G,with_labels=True)
+        plt.show()
 
     return G
 
 #---------------------------
-def check_recov(H, G, accum_rcv):
-    for failed_node in accum_rcv.keys():
-        #if the recovery amount reaches the capacity,
-        #the node becomes functional
-        if accum_rcv.get(failed_node) == G.node[failed_node]["cap"]:
-            recover(H, G, failed_node)
-    return H
-
-
-
-#---------------------------
-
-#put back the recovered node using the original topology setting in G
-def recover(H, G, node):
-    H.add_node(node, 
-            util=G.node[node]["util"],
-            cap=G.node[node]["cap"],
-            rcv_amt=G.node[node]["cap"])
-
-    for edge in G.edges(node):
-        H.add_edge(edge[0],edge[1])
-
-    return H    
-
-#---------------------------
-
-#system utility at time t is defined as
-#the size of the maximum connected component
-#system utility is the sum of the size over time
-def evaluate(H):
-    giant_comp = max(nx.connected_components(H), key=len)
-    return len(giant_comp)
-
-#---------------------------
-
-#random recovery process where we put recovery resources randomly
-#to the failed nodes (even after the recovery, nodes can recieve 
-# the recovery resouece
-def random_recovery(failed_nodes, resources, time):
-    recv_at_t = {}
-    for failed_node in failed_nodes:
-        recv_at_t.update({failed_node: 0.0})
-
-    total = 0
-
-    while total < resources.get(time):
-        target = failed_nodes[randint(0, len(failed_nodes)-1)]
-        amount = randint(0, resources.get(time) - total)
-        total += amount
-
-        so_far = recv_at_t.get(target) + amount
-        recv_at_t.update({target: so_far})
-
-    print(time, total)
-
-    return recv_at_t      
 
+#Progressive recovery of an arbitrary graph. A failed node becomes functional
+#again once the resources it received add up to its capacity ("cap"), and it
+#can receive any fraction of the resources of a time step (even after the
+#recovery, nodes can recieve the recovery resource). The system utility at
+#time t is the size of the maximum connected component of the functional
+#nodes, and the system utility of a recovery is the sum over time.
+#
+#The state is kept in arrays: an allocation is a (T, F) array with the
+#resources every failed node receives at every time step (in the order of
+#failed_nodes), and a batch of B allocations is a (B, T, F) array, so
+#thousands of allocation policies are simulated at once.
+class ProgressiveRecovery:
+    def __init__(self, G, failed_nodes, caps=None):
+        nodes = list(G.nodes())
+        index = {node: i for i, node in enumerate(nodes)}
+
+        if caps is None:
+            caps = nx.get_node_attributes(G, "cap")
+
+        self.G = G
+        self.failed_nodes = list(failed_nodes)
+        self.failed = np.array([index[node] for node in self.failed_nodes], dtype=np.int64)
+        self.caps = np.array([caps[node] for node in self.failed_nodes], dtype=float)
+        self.neighbors = [[index[u] for u in G.neighbors(node) if u != node] for node in nodes]
+        self.number_of_nodes = len(nodes)
+
+    #step in which every failed node becomes functional, T if it never does.
+    #allocations is a (T, F) or (B, T, F) array, the result has shape (F,) or (B, F)
+    def recovery_steps(self, allocations):
+        allocations = np.asarray(allocations, dtype=float)
+        T = allocations.shape[-2]
+
+        #a small tolerance so that fractions adding up to the capacity count
+        covered = np.cumsum(allocations, axis=-2) >= self.caps - 1e-9
+        return np.where(covered.any(axis=-2), covered.argmax(axis=-2), T)
+
+    #system utility at every time step, as a (T,) or (B, T) array. The maximum
+    #connected component only grows as nodes recover, so it is found by adding
+    #the nodes to a union-find in the order they recover, once for every
+    #distinct set of recovery steps in the batch.
+    def utilities(self, allocations):
+        allocations = np.asarray(allocations, dtype=float)
+        batch = allocations.reshape((-1,) + allocations.shape[-2:])
+        T = batch.shape[1]
+
+        #nodes that did not fail are functional from the first time step
+        activation = np.zeros((len(batch), self.number_of_nodes), dtype=np.int64)
+        activation[:, self.failed] = self.recovery_steps(batch)
+
+        utils = np.zeros((len(batch), T), dtype=np.int64)
+        scored = {}
+        for b in range(len(batch)):
+            key = activation[b].tobytes()
+            if key not in scored:
+                scored[key] = largest_component_sizes(self.neighbors, activation[b].tolist(), T)
+            utils[b] = scored[key]
+
+        return utils.reshape(allocations.shape[:-2] + (T,))
+
+    #total system utility of an allocation, or of every allocation of a batch
+    def evaluate(self, allocations):
+        return self.utilities(allocations).sum(axis=-1)
+
+    #random recovery process where we put the resources of every time step
+    #randomly on the failed nodes: the fractions of the budget are uniform on
+    #the simplex (Dirichlet(1, ..., 1)). resources is a list (or dict) with
+    #the budget of every time step. Returns a (T, F) allocation, or a
+    #(batch_size, T, F) batch.
+    def random_allocations(self, resources, batch_size=None, seed=None):
+        rng = np.random.default_rng(seed)
+        if isinstance(resources, dict):
+            resources = [resources[time] for time in sorted(resources)]
+        budgets = np.asarray(resources, dtype=float)
+
+        shape = (len(budgets),) if batch_size is None else (batch_size, len(budgets))
+        fractions = rng.dirichlet(np.ones(len(self.failed_nodes)), size=shape)
+        return fractions * budgets[:, None]
+
+    #Monte Carlo estimate of the value of random recovery: the total system
+    #utility of batch_size random allocation policies, simulated in chunks
+    def monte_carlo(self, resources, batch_size=10000, seed=None, chunk_size=10000):
+        rng = np.random.default_rng(seed)
+        totals = []
+        for start in range(0, batch_size, chunk_size):
+            allocations = self.random_allocations(resources, min(chunk_size, batch_size - start), rng)
+            totals.append(self.evaluate(allocations))
+
+        return np.concatenate(totals)
 
 #---------------------------
 #representation
@@ -133,84 +168,50 @@ def show(data, node_ids, T, total_val):
     plt.show()
 
 
-#---------------------------
-
-
 #---------------------------
 
 ############################################
 #MAIN LOGIC
 ############################################
-G = generate_graph()
-T = 10
-#the size of failure
-print("Decide the size of failure:")
-f = 4 #input() # now for this experience, we have 4 failed nodes
-
-failed_nodes = []
-#count = 0
-#while count < int(f):
-#    failure = randint(0,len(G.nodes())-1)
-#    if failure not in failed_nodes:
-#        failed_nodes.append(failure)
-#        count += 1
-
-failed_nodes = [1,4,6,3] # fixed failed nodes
-
-
-rcv_amts = nx.get_node_attributes(G, "rcv_amt")
-for failed_node in failed_nodes:
-    rcv_amts[failed_node] = 0
-
-#failed graph
-H = G.copy()
-for failed_node in failed_nodes:
-    H.remove_node(failed_node)
-
-# At time t, we have 4 resoueces
-resources = {}
-for time in range(T):
-    resources.update({time: 4.0})
-
-#failed nodes do not have any resouce right after the failure
-accum_rcv = {}
-for failed_node in failed_nodes:
-    accum_rcv.update({failed_node : 0.0})
-
-progressive_rcv = []
-total_val = 0;
-
-#over time 
-for time in range(T):
-    print("nodes in H: ", H.nodes())
-    #get the resource distribution at time t
-    rcv_at_t = random_recovery(failed_nodes, resources, time)
-
-    for failed_node in failed_nodes:
-        accum_rcv[failed_node] = accum_rcv.get(failed_node) + rcv_at_t.get(failed_node)
-
-    #original list order doesn't change
-    progressive_rcv_at_t = []
-    for fn in sorted(failed_nodes):
-        progressive_rcv_at_t.append(rcv_at_t.get(fn))
-
-    #strore the distribution
-    progressive_rcv.append(progressive_rcv_at_t)
-
-    #update H based on recovered nodes
-    H = check_recov(H, G, accum_rcv)
-    val = evaluate(H)
-    print("Eval at time ", time, " - ", val)
-
-    total_val += val
-
-print(total_val)
-    
-#print(progressive_rcv)
-show(progressive_rcv, sorted(failed_nodes), T, total_val)
-
-
-f = open("result.csv", "a")
-s = str(total_val) + "\n"
-f.write(s)
-f.close()
+def main():
+    G = generate_graph()
+    T = 10
+    #the size of failure
+    print("Decide the size of failure:")
+    f = 4 #input() # now for this experience, we have 4 failed nodes
+
+    failed_nodes = [1,4,6,3] # fixed failed nodes
+
+    # At time t, we have 4 resoueces
+    resources = {}
+    for time in range(T):
+        resources.update({time: 4.0})
+
+    sim = ProgressiveRecovery(G, failed_nodes)
+
+    #get the resource distribution over time, original list order doesn't change
+    order = np.argsort(failed_nodes)
+    allocation = sim.random_allocations(resources)
+    progressive_rcv = allocation[:, order].tolist()
+
+    utils = sim.utilities(allocation)
+    for time in range(T):
+        print("Eval at time ", time, " - ", utils[time])
+
+    total_val = utils.sum().item()
+    print(total_val)
+
+    #value of random recovery over many random policies
+    totals = sim.monte_carlo(resources, 10000)
+    print("Random recovery: mean", totals.mean(), "std", totals.std(), "max", totals.max())
+
+    #print(progressive_rcv)
+    show(progressive_rcv, sorted(failed_nodes), T, total_val)
+
+    f = open("result.csv", "a")
+    s = str(total_val) + "\n"
+    f.write(s)
+    f.close()
+
+if __name__ == "__main__":
+    main()
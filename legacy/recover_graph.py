@@ -1,127 +1,190 @@
-import networkx as nx
-import numpy as np
-import matplotlib.pyplot as plt
-import numpy as np
-import random
-
-from tree_recovery import plot_graph
-from prog import iterate_over_failures, root_to_leaves
-
-def read_gml(path):
-    G = nx.read_gml(path)
-    return G
-
-# generate a random graph structure with len(recovery_cost) nodes
-# and some non-zero amount of edges
-def sample_graph(recovery_cost):
-    G = nx.Graph()
-
-    utils = {}
-    demands = {}
-
-    for node in range(len(recovery_cost)):
-        G.add_node(node)
-        utils.update({node: 1.0})
-        demands.update({node: recovery_cost[node]})
-    
-    # generate random graph with (n-1) <= x <= n(n-1)/2
-    # n(n-1) / 2 ensures the final graph will be fully connected (+ 1 is for exclusion in python)
-    # n - 1 some arbitrary lower bound
-    n = len(recovery_cost)
-    num_edges = random.randint(n-1, (n * (n - 1)) / 2 + 1)
-    edges = 0
-
-    while edges <= num_edges:
-        # try generating a random edge
-        try:
-            G.add_edge(random.randint(0, len(recovery_cost) - 1), random.randint(0, len(recovery_cost) - 1))
-            edges += 1
-
-        # if we couldn't try again
-        except:
-            continue
-
-    '''
-    # original test graph
-    G.add_edge(0,1)
-    G.add_edge(0,2)
-    G.add_edge(0,5)
-    G.add_edge(1,2)
-    G.add_edge(2,3)
-    G.add_edge(2,5)
-    G.add_edge(3,4)
-    G.add_edge(4,5)
-    ''' 
-
-    nx.set_node_attributes(G, name='util', values=utils)
-    nx.set_node_attributes(G, name='demand', values=demands)
-    
-    tree_recovery.plot_graph(G, 1, 'plots/recovery_graphs/1.png')
-    return G
-
-# given a graph G and the cost to recover a node in G (costs), 
-# we apply a recovery confiugration (config) and return the total system utility
-def simulate_recovery(G, config):
-    H = G.copy()
-    demands = nx.get_node_attributes(H, name='demand')
-    util = 0 
- 
-    for step in config:
-        # remove the resources from rcv_amounts
-        for index in range(len(step)):
-            demands[index] -= step[index]
-
-        # create a new subgraph H, which is G with all nodes where
-        # recovery != 0 are removed
-        H = G.copy()
-        for node in G:
-            if demands[node] > 0:
-                H.remove_node(node)
-
-        # The largest connected component in H is our utility at t
-        util += len(max(nx.connected_components(H), key=len))
-
-    return util
-
-def max_util(G):
-    test_costs = [2, 2, 2, 2, 0, 0]
-    root = iterate_over_failures(test_costs, 2)
-    all_paths = root_to_leaves(root)
-
-    #print(all_paths)
-    #print(len(all_paths))
-   
-    utils = []
-    G = sample_graph(test_costs)
-
-    for path in all_paths:
-        utils.append(simulate_recovery(G, path))
-
-    print(utils)
-    print(max(utils))
-
-def main():
-    # G = read_gml('gml/DIGEX.gml')
-
-    # test_costs = [5, 2, 3, 1, 0, 4]
-    test_costs = [2, 2, 2, 2, 0, 0]
-    root = iterate_over_failures(test_costs, 2)
-    all_paths = root_to_leaves(root)
-
-    #print(all_paths)
-    #print(len(all_paths))
-   
-    utils = []
-    G = sample_graph(test_costs)
-
-    for path in all_paths:
-        utils.append(simulate_recovery(G, path))
-
-    print(utils)
-    print(max(utils))
-    #nx.draw(sample_graph(test_costs))
-    #plt.draw()
-    #plt.savefig('test.png')
-
-if __name__ == "__main__":
+import networkx as nx
+import numpy as np
+import matplotlib.pyplot as plt
+import numpy as np
+import random
+
+from tree_recovery import plot_graph
+from prog import root_to_leaves, best_path
+
+def read_gml(path):
+    G = nx.read_gml(path)
+    return G
+
+# generate a random graph structure with len(recovery_cost) nodes
+# and some non-zero amount of edges
+def sample_graph(recovery_cost):
+    G = nx.Graph()
+
+    utils = {}
+    demands = {}
+
+    for node in range(len(recovery_cost)):
+        G.add_node(node)
+        utils.update({node: 1.0})
+        demands.update({node: recovery_cost[node]})
+    
+    # generate random graph with (n-1) <= x <= n(n-1)/2
+    # n(n-1) / 2 ensures the final graph will be fully connected (+ 1 is for exclusion in python)
+    # n - 1 some arbitrary lower bound
+    n = len(recovery_cost)
+    num_edges = random.randint(n-1, (n * (n - 1)) / 2 + 1)
+    edges = 0
+
+    while edges <= num_edges:
+        # try generating a random edge
+        try:
+            G.add_edge(random.randint(0, len(recovery_cost) - 1), random.randint(0, len(recovery_cost) - 1))
+            edges += 1
+
+        # if we couldn't try again
+        except:
+            continue
+
+    '''
+    # original test graph
+    G.add_edge(0,1)
+    G.add_edge(0,2)
+    G.add_edge(0,5)
+    G.add_edge(1,2)
+    G.add_edge(2,3)
+    G.add_edge(2,5)
+    G.add_edge(3,4)
+    G.add_edge(4,5)
+    ''' 
+
+    nx.set_node_attributes(G, name='util', values=utils)
+    nx.set_node_attributes(G, name='demand', values=demands)
+    
+    tree_recovery.plot_graph(G, 1, 'plots/recovery_graphs/1.png')
+    return G
+
+# given a graph G and the cost to recover a node in G (costs), 
+# we apply a recovery confiugration (config) and return the total system utility
+def simulate_recovery(G, config):
+    return score_paths(G, [config])[0].item()
+
+# Total utility of many recovery configurations (paths) of G at once, without modifying
+# G. After every step of a path, the utility is the size of the largest connected
+# component of the recovered nodes (the nodes whose demand is covered), or 0 if there
+# are none. The step in which every node is recovered is computed for a chunk of paths
+# at a time with numpy, and the largest component over time comes from activating the
+# nodes in that order in a union-find, so each path costs O(n + E) instead of a graph
+# copy and a connected components search per step. Paths with the same activation
+# steps are only scored once.
+def score_paths(G, paths, chunk_size=10000):
+    n = G.number_of_nodes()
+    demands = nx.get_node_attributes(G, name='demand')
+    demand = np.array([demands[node] for node in range(n)])
+    neighbors = [[u for u in G.neighbors(node) if u != node] for node in range(n)]
+
+    totals = np.zeros(len(paths), dtype=np.int64)
+    scored = {}
+    for start in range(0, len(paths), chunk_size):
+        chunk = paths[start:start + chunk_size]
+        lengths = [len(path) for path in chunk]
+        steps = np.zeros((len(chunk), max(lengths + [1]), n))
+        for i, path in enumerate(chunk):
+            steps[i, :len(path)] = path
+
+        # first step in which the allocated resources cover the demand of every node, len(path) if never
+        covered = np.cumsum(steps, axis=1) >= demand
+        activation = np.where(covered.any(axis=1), covered.argmax(axis=1), steps.shape[1])
+
+        for i in range(len(chunk)):
+            key = (lengths[i], activation[i].tobytes())
+            if key not in scored:
+                scored[key] = sum(largest_component_sizes(neighbors, activation[i].tolist(), lengths[i]))
+            totals[start + i] = scored[key]
+
+    return totals
+
+# Size of the largest connected component of the nodes activated so far, at every step
+# 0, ..., length - 1, given the step in which every node is activated. Nodes are added to
+# a union-find in the order they activate, so the largest component only grows.
+def largest_component_sizes(neighbors, activation, length):
+    parent = list(range(len(activation)))
+    size = [1] * len(activation)
+    active = [False] * len(activation)
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    order = sorted(range(len(activation)), key=lambda node: activation[node])
+    index = 0
+    largest = 0
+    sizes = []
+    for step in range(length):
+        while index < len(order) and activation[order[index]] <= step:
+            node = order[index]
+            index += 1
+            active[node] = True
+            largest = max(largest, 1)
+            for neighbor in neighbors[node]:
+                if active[neighbor]:
+                    a, b = find(node), find(neighbor)
+                    if a != b:
+                        if size[a] < size[b]:
+                            a, b = b, a
+                        parent[b] = a
+                        size[a] += size[b]
+                        largest = max(largest, size[a])
+
+        sizes.append(largest)
+
+    return sizes
+
+# Best recovery configuration sequence for G (nodes 0, ..., n - 1 with a demand
+# attribute) with r resources per time step, found with the memoized DP of prog.best_path
+# instead of simulating every path. Returns (max util, path), with util counted like
+# simulate_recovery: the size of the largest connected component of recovered nodes,
+# summed over the time steps. With all_paths, every path is enumerated and scored in
+# one pass with score_paths instead, e.g. to check the DP on small instances.
+# The DP has a state per vector of remaining costs, prod(cost + 1) of them (3^10 = 59049
+# for 10 nodes of demand 2), each trying every config of r resources, so 10 nodes of
+# demand 2 with r = 2 take seconds and every extra node multiplies that by cost + 1.
+def max_util(G, r=2, all_paths=False):
+    demands = nx.get_node_attributes(G, name='demand')
+    costs = [demands[node] for node in range(G.number_of_nodes())]
+
+    # the largest connected component only depends on the set of recovered nodes
+    sizes = {}
+    def utility(remaining_costs):
+        recovered = frozenset(node for node, cost in enumerate(remaining_costs) if cost == 0)
+        if recovered not in sizes:
+            sizes[recovered] = max((len(c) for c in nx.connected_components(G.subgraph(recovered))), default=0)
+        return sizes[recovered]
+
+    if all_paths:
+        paths = root_to_leaves(costs, r)
+        utils = score_paths(G, paths)
+        util, path = utils.max().item(), paths[int(utils.argmax())]
+    else:
+        util, path = best_path(costs, r, utility)
+
+    return util, path
+
+def main():
+    # G = read_gml('gml/DIGEX.gml')
+
+    # test_costs = [5, 2, 3, 1, 0, 4]
+    test_costs = [2, 2, 2, 2, 0, 0]
+    all_paths = root_to_leaves(test_costs, 2)
+
+    #print(all_paths)
+    #print(len(all_paths))
+   
+    G = sample_graph(test_costs)
+    utils = score_paths(G, all_paths).tolist()
+
+    print(utils)
+    print(max(utils))
+    #nx.draw(sample_graph(test_costs))
+    #plt.draw()
+    #plt.savefig('test.png')
+
+if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -6,10 +6,12 @@ import random
 import operator
 import os, shutil
 import itertools
+import heapq
 import time
 import sys
 #from progress.bar import Bar
 import math
+import bisect
 import multiprocessing
 
 def r_tree(nodes, height=None):
@@ -62,17 +64,18 @@ def evaluate_total_income(H):
 
     return total_income
 
-def merge_nodes(H, root, v):
+def merge_nodes(H, root, v, in_place=False):
     '''
     Merges two nodes in a given graph, returns a new one
 
     :param H: networkx graph
     :param root: root node to merge
     :param v: node to merge with root
+    :param in_place: contract v into root in H itself instead of a copy of H
     :return: new graph G, with V_H - 1 vertices and E_H or E_H - 1 edges.
     '''
-    G = H.copy()
-    neighbors = G.neighbors(v)
+    G = H if in_place else H.copy()
+    neighbors = list(G.neighbors(v))
     for node in neighbors:
         if node != root:
             G.add_edge(node, root)
@@ -140,18 +143,59 @@ def par_max_util_configs(G, independent_nodes):
     
     :param G: networkx graph
     :param root: list of independent nodes in G (these don't need to be recovered)
-    :return: list of possibly maximum util configurations
+    :return: generator of possibly maximum util configurations
     '''
-    number_of_nodes = G.number_of_nodes()
+    # only the valid recovery orders are generated, lazily, so prune_map keeps every one of them
+    for config in valid_orders(G, independent_nodes):
+        yield [tuple(independent_nodes), config, G]
+
+
+def valid_orders(G, independent_nodes, prefix=(), length=None):
+    '''
+    Generate the recovery orders of G that prune_map keeps, i.e. where every node is a neighbor of a node recovered
+    before it. The orders are built by a depth first search over the frontier of the functional nodes, so invalid
+    prefixes are never generated and only the current path is held in memory. Orders come out in lexicographic order.
+
+    :param G: networkx graph
+    :param independent_nodes: list of independent nodes in G (these don't need to be recovered)
+    :param prefix: (optional) valid partial order of non independent nodes that every generated order starts with
+    :param length: (optional) stop at orders of this many non independent nodes, e.g. to split the search into tasks
+    :return: generator of tuples of non independent nodes, in recovery order
+    '''
+    adj = {v: set(G.neighbors(v)) for v in G.nodes()}
+    recovered = set(independent_nodes).union(prefix)
+    order = list(prefix)
+    if length is None:
+        length = G.number_of_nodes() - len(independent_nodes)
+
+    if len(order) >= length:
+        yield tuple(order)
+        return
+
+    frontier = set().union(*[adj[v] for v in recovered]) - recovered
+    # every level of the stack holds the sorted frontier we branch on, the next branch and the frontier itself
+    stack = [[sorted(frontier), 0, frontier]]
+    while stack:
+        level = stack[-1]
+        if level[1] == len(level[0]):
+            # done branching on this level, undo the node that led to it
+            stack.pop()
+            if stack:
+                recovered.discard(order.pop())
+            continue
 
-    # non independent nodes are nodes we need to recover; they are all nodes that are not-indepedent
-    non_independent_nodes = set(range(number_of_nodes)) - set(independent_nodes)
+        v = level[0][level[1]]
+        level[1] += 1
+        order.append(v)
 
-    # create all possible node recovery orders
-    all_permutations = list(itertools.permutations(non_independent_nodes))
-    all_permutations = [[tuple(independent_nodes), config, G] for config in all_permutations]
+        if len(order) == length:
+            yield tuple(order)
+            order.pop()
+            continue
 
-    return all_permutations
+        recovered.add(v)
+        frontier = (level[2] | adj[v]) - recovered
+        stack.append([sorted(frontier), 0, frontier])
 
 def prune_map(config_graph):
     '''
@@ -180,6 +224,37 @@ def prune_map(config_graph):
 
     return config
 
+def prefix_configs(G, independent_nodes, prefix=(), chunk_size=100000, include_independent_nodes=False):
+    '''
+    Stream the valid configurations starting with a given prefix (see valid_orders) as flat int arrays, one row per
+    configuration and at most chunk_size rows per array, so only one chunk of the subtree is in memory at a time.
+
+    :param G: networkx graph
+    :param independent_nodes: List of independent nodes
+    :param prefix: valid partial order of non independent nodes every configuration starts with
+    :param chunk_size: most configurations per array
+    :param include_independent_nodes: start every row with the independent nodes
+    :return: generator of int arrays of configurations
+    '''
+    orders = valid_orders(G, independent_nodes, prefix)
+    width = G.number_of_nodes() - len(independent_nodes)
+    independent = np.array(independent_nodes, dtype=np.int64)
+
+    if width == 0:
+        # nothing to recover: the empty order is the only configuration, and it has no entries to count rows by
+        yield independent.reshape(1, -1) if include_independent_nodes else np.zeros((1, 0), dtype=np.int64)
+        return
+
+    while True:
+        chunk = np.fromiter(itertools.chain.from_iterable(itertools.islice(orders, chunk_size)),
+                            dtype=np.int64).reshape(-1, width)
+        if not len(chunk):
+            return
+
+        if include_independent_nodes:
+            chunk = np.hstack([np.tile(independent, (len(chunk), 1)), chunk])
+        yield chunk
+
 def calc_height(G, root):
     '''
     Calculate height of tree, longest path from root to leaf
@@ -213,13 +288,178 @@ def plot_bar_x(data, label, dir):
 
     plt.savefig(dir)
 
+def node_arrays(G):
+    '''
+    Collect the util and demand attributes of G into arrays indexed by node id. Assumes the nodes
+    of G are labelled 0, ..., n - 1.
+
+    :param G: networkx graph with attributes "util" and "demand" for each node
+    :return: (util, demand) tuple of numpy arrays of length G.number_of_nodes()
+    '''
+    util = nx.get_node_attributes(G, 'util')
+    demand = nx.get_node_attributes(G, 'demand')
+
+    number_of_nodes = G.number_of_nodes()
+    util = np.array([util[node] for node in range(number_of_nodes)])
+    demand = np.array([demand[node] for node in range(number_of_nodes)])
+
+    return util, demand
+
+class ResourceSchedule:
+    '''
+    Resources available per round, e.g. repair crews arriving over time. Round t (counting from 1) has budgets[t - 1]
+    resources and the last budget repeats after the end of the schedule, so a constant budget C is
+    ResourceSchedule([C]). Resources left over in a round carry over to the next node like everywhere else, so a node
+    is recovered in the first round whose cumulative resources cover the cumulative demand up to that node. The prefix
+    sums of the budgets are computed once, which makes that round a binary search instead of a round by round walk.
+    '''
+
+    def __init__(self, budgets):
+        '''
+        :param budgets: resources of round 1, 2, ... as a number or a 1-D sequence of non negative numbers, the last
+        of which must be positive
+        '''
+        budgets = np.atleast_1d(np.asarray(budgets))
+        if budgets.ndim != 1 or len(budgets) == 0:
+            raise ValueError('A resource schedule needs a 1-D sequence of budgets')
+        if (budgets < 0).any() or budgets[-1] <= 0:
+            raise ValueError('Resource budgets must be non negative, and the last one positive')
+
+        self.budgets = budgets
+        self.horizon = len(budgets)
+        self.last = budgets[-1].item()
+        # cumulative[t] is the resources of rounds 1, ..., t
+        self.cumulative = np.concatenate([[0], np.cumsum(budgets)])
+        self._cumulative = self.cumulative.tolist()
+
+        # past the horizon the schedule is a constant budget, shifted by what the schedule lacks (or has in excess)
+        # compared to running at the last budget from round 1. The shift is 0 for a constant budget, so rounds
+        # past the horizon are computed exactly like ceil(D / C).
+        self.offset = self.horizon * self.last - self._cumulative[-1]
+
+    def __repr__(self):
+        return 'ResourceSchedule({0})'.format(self.budgets.tolist())
+
+    def budget(self, t):
+        '''
+        :param t: round, counting from 1
+        :return: resources available in round t
+        '''
+        return self.budgets[t - 1].item() if t <= self.horizon else self.last
+
+    def available(self, t):
+        '''
+        :param t: round, counting from 1 (0 for none)
+        :return: resources available in rounds 1, ..., t
+        '''
+        if t <= self.horizon:
+            return self._cumulative[max(t, 0)]
+
+        return self._cumulative[-1] + (t - self.horizon) * self.last
+
+    def round(self, cumulative_demand, demand, zeros=1):
+        '''
+        Round in which a node is recovered: the first round whose cumulative resources cover the cumulative demand.
+        A node of demand 0 needs no resources but is only brought online in the round after the previous node when
+        the previous node used up its round. If that round has no resources, the node uses it up in turn, so the
+        next node of demand 0 is brought online in the round after it, up to the first round with resources.
+
+        :param cumulative_demand: demand of the node and of every node recovered before it
+        :param demand: demand of the node
+        :param zeros: for a node of demand 0, its position in the run of nodes of demand 0 it ends, i.e. 1 plus the
+        number of nodes of demand 0 recovered right before it
+        :return: round, counting from 1
+        '''
+        if cumulative_demand <= self._cumulative[-1]:
+            t = bisect.bisect_left(self._cumulative, cumulative_demand)
+            if demand > 0 or self._cumulative[t] != cumulative_demand:
+                return t
+            # skip one round without resources per node of demand 0, the first round with resources takes the rest
+            return min(t + zeros, bisect.bisect_right(self._cumulative, cumulative_demand))
+
+        shifted = cumulative_demand + self.offset
+        if demand > 0:
+            return math.ceil(shifted / self.last)
+
+        return math.floor(shifted / self.last) + 1
+
+    def rounds(self, cumulative_demands, demands):
+        '''
+        Vectorized round of the nodes of recovery orders, see round.
+
+        :param cumulative_demands: array of cumulative demands, the last axis in recovery order
+        :param demands: array of node demands of the same shape
+        :return: int array of rounds
+        '''
+        cumulative_demands = np.asarray(cumulative_demands)
+        positive = np.asarray(demands) > 0
+        shifted = cumulative_demands + self.offset
+        rounds = np.where(positive, -(-shifted // self.last), shifted // self.last + 1)
+        if self.horizon == 1:
+            # a constant budget needs no search
+            return rounds.astype(np.int64)
+
+        # position of every node of demand 0 in its run of nodes of demand 0, see round
+        index = np.arange(positive.shape[-1])
+        zeros = index - np.maximum.accumulate(np.where(positive, index, -1), axis=-1)
+
+        t = np.searchsorted(self.cumulative, cumulative_demands, side='left')
+        exact = ~positive & (self.cumulative[np.minimum(t, self.horizon)] == cumulative_demands)
+        skipped = np.minimum(t + zeros, np.searchsorted(self.cumulative, cumulative_demands, side='right'))
+        within = np.where(exact, skipped, t)
+
+        return np.where(cumulative_demands <= self._cumulative[-1], within, rounds).astype(np.int64)
+
+def resource_schedule(resources):
+    '''
+    :param resources: resources per round, as a constant, a sequence of budgets per round or a ResourceSchedule
+    :return: ResourceSchedule
+    '''
+    if isinstance(resources, ResourceSchedule):
+        return resources
+
+    return ResourceSchedule(resources)
+
+def evaluate_orders(orders, util, demand, resources):
+    '''
+    Closed form of RecoveryEnv.recover. Resources left over after recovering a node carry over to the next
+    node, so the k-th node of an order is functional from round r_k = ceil((d_1 + ... + d_k) / resources)
+    on (or, with a resource schedule, the first round whose cumulative resources cover d_1 + ... + d_k), and
+    counts towards the utility of rounds r_k, ..., T where T is the round of the last node. The total
+    utility is then the dot product of the utils with (T - r + 1).
+
+    :param orders: recovery order (1-D) or batch of orders of the same length (2-D), as node ids. Independent
+    nodes should be left out unless their recovery is to be counted.
+    :param util: array of node utils indexed by node id, see node_arrays
+    :param demand: array of node demands indexed by node id, see node_arrays
+    :param resources: resources per time step, or a schedule of resources per round (see ResourceSchedule)
+    :return: total utility of the order, or array of total utilities of the batch
+    '''
+    schedule = resource_schedule(resources)
+    orders = np.asarray(orders, dtype=np.int64)
+    batch = np.atleast_2d(orders)
+    if batch.shape[1] == 0:
+        totals = np.zeros(len(batch), dtype=util.dtype)
+    else:
+        # completion round of every node. A node of demand 0 needs no resources but is only brought online in
+        # the round after the previous node, e.g. in the next round when the previous node used up the round.
+        demands = demand[batch]
+        cum_demands = np.cumsum(demands, axis=1)
+        rounds = schedule.rounds(cum_demands, demands)
+        totals = np.einsum('ij,ij->i', util[batch], rounds[:, -1:] - rounds + 1)
+
+    if orders.ndim == 1:
+        return totals[0].item()
+
+    return totals
+
 def DP_optimal(G, independent_nodes, resources):
     '''
     DP algorithm calculating optimal recovery utility
 
     :param G: networkx graph with attributes "util" and "demand" for each node
     :param independent_nodes: already functional nodes of the problem, assumed to be list of nodes in G
-    :param resources: resources per turn
+    :param resources: resources per turn, or a schedule of resources per round (see ResourceSchedule)
     :return: (max total util, recovery config) tuple
     '''
 
@@ -231,19 +471,31 @@ def DP_optimal(G, independent_nodes, resources):
     V = G.number_of_nodes() - len(independent_nodes)
     C = resources
 
-    # Optimality checker warning
-    already_warned = False
-    for d_vj in demand.values():
-        for d_vi in demand.values():
-            if d_vj != d_vi and (d_vj + d_vi <= (2*C - 1)) and not already_warned:
-                print("WARNING ========================")
-                print("Calculation of optimal may not be correct")
-                print("Please make sure demand(vj) + demand(vi) <= 2C - 1 for all pairs (vj, vi) in G")
-                print(d_vj, "+", d_vi, "<=", 2*C - 1, "\n")
-                already_warned = True
-
     # note: use (V+1) in range since it is not inclusive
     vertex_set = frozenset(range(G.number_of_nodes())) - frozenset(independent_nodes)
+
+    # With a schedule the round of a node depends on when it is recovered, so we use its exact completion round (the
+    # nodes outside of X are recovered before it) and count the utility of the rounds from the previous node to it,
+    # like n_environment. The round of a node of demand 0 also depends on how many nodes of demand 0 were recovered
+    # right before it (see ResourceSchedule.round), so we keep Z and B per set X and number j of such nodes.
+    schedule = None
+    zero_demand_nodes = frozenset()
+    if isinstance(resources, ResourceSchedule) or np.ndim(resources) > 0:
+        schedule = resource_schedule(resources)
+        total_demand = sum(demand[v] for v in vertex_set)
+        total_util = sum(util[v] for v in vertex_set)
+        zero_demand_nodes = frozenset(v for v in vertex_set if demand[v] == 0)
+    else:
+        # Optimality checker warning
+        already_warned = False
+        for d_vj in demand.values():
+            for d_vi in demand.values():
+                if d_vj != d_vi and (d_vj + d_vi <= (2*C - 1)) and not already_warned:
+                    print("WARNING ========================")
+                    print("Calculation of optimal may not be correct")
+                    print("Please make sure demand(vj) + demand(vi) <= 2C - 1 for all pairs (vj, vi) in G")
+                    print(d_vj, "+", d_vi, "<=", 2*C - 1, "\n")
+                    already_warned = True
    
     # Init Z and B dicts, Z for saving and B for printing out config at end
     Z = {}
@@ -251,7 +503,8 @@ def DP_optimal(G, independent_nodes, resources):
 
     # note: turns out you can only hash immutable objects, so we use "frozenset" instead of "set"
     # save 0 utility at the emptyset hash
-    Z[(frozenset([])).__hash__()] = 0
+    for j in range(len(zero_demand_nodes) + 1):
+        Z[((frozenset([])).__hash__(), j)] = 0
 
     for s in range(1, V+1):
         # generate all |s| size subsets
@@ -267,35 +520,56 @@ def DP_optimal(G, independent_nodes, resources):
                     if G.has_edge(v_i, v_j) and (v_i not in adj_nodes):
                         adj_nodes.append(v_i)
 
-            # init q to < 0
-            q = float(-1)
-            for v_i in adj_nodes:
-                sum_demands = sum([demand[int(v_j)] for v_j in X if int(v_j) != int(v_i)])
-                q_ = util[v_i] * (1 + math.ceil(sum_demands / C)) + Z[(frozenset(X) - frozenset([v_i])).__hash__()]
-
-                if q_ > q:
-                    q = q_
-                    B[frozenset(X).__hash__()] = v_i
-                #endif
-            #endfor
-
-            Z[(frozenset(X)).__hash__()] = q
+            # j can be at most the number of nodes of demand 0 recovered before X
+            for j in range(len(zero_demand_nodes - frozenset(X)) + 1):
+                # init q to < 0
+                q = float(-1)
+                for v_i in adj_nodes:
+                    sum_demands = sum([demand[int(v_j)] for v_j in X if int(v_j) != int(v_i)])
+                    next_j = j + 1 if v_i in zero_demand_nodes else 0
+                    if schedule is None:
+                        rounds = 1 + math.ceil(sum_demands / C)
+                        q_ = util[v_i] * rounds
+                    else:
+                        cumulative_demand = total_demand - sum_demands
+                        previous_demand = cumulative_demand - demand[v_i]
+                        if j > 0:
+                            previous_round = schedule.round(previous_demand, 0, j)
+                        elif len(X) < V:
+                            previous_round = schedule.round(previous_demand, 1)
+                        else:
+                            previous_round = 0
+                        recovered_util = total_util - sum(util[v_j] for v_j in X)
+                        rounds = schedule.round(cumulative_demand, demand[v_i], next_j) - previous_round
+                        q_ = rounds * recovered_util + util[v_i]
+                    q_ += Z[((frozenset(X) - frozenset([v_i])).__hash__(), next_j)]
+
+                    if q_ > q:
+                        q = q_
+                        B[(frozenset(X).__hash__(), j)] = v_i
+                    #endif
+                #endfor
+
+                Z[((frozenset(X)).__hash__(), j)] = q
         #endfor
     #endfor
     
     # We know independent nodes are first to be recovered
     opt_plan = independent_nodes
     Y = set([])
+    j = 0
 
     while frozenset(Y) != vertex_set:
         # append B[V \ Y]
-        opt_plan.append(B[(vertex_set - frozenset(Y)).__hash__()])
+        v_i = B[((vertex_set - frozenset(Y)).__hash__(), j)]
+        opt_plan.append(v_i)
+        j = j + 1 if v_i in zero_demand_nodes else 0
 
         # Y = Y \cup B[V \ Y]
-        Y = Y | set([B[(vertex_set - frozenset(Y)).__hash__()]])
+        Y = Y | set([v_i])
 
     # return (max total util, recovery config)
-    return (Z[vertex_set.__hash__()], opt_plan)
+    return (Z[(vertex_set.__hash__(), 0)], opt_plan)
 
 def simulate_tree_recovery(G, resources, root, include_root=False, draw=True, debug=False):
     '''
@@ -308,7 +582,7 @@ def simulate_tree_recovery(G, resources, root, include_root=False, draw=True, de
     income, util, and demand.
 
     :param G: networkx graph
-    :param resources: Number of resources per time step
+    :param resources: Number of resources per time step, or a schedule of resources per round (see ResourceSchedule)
     :param draw: If true, plot graph at each step.
     :param debug: output logs to std.out
     :return: root of G
@@ -330,19 +604,21 @@ def simulate_tree_recovery(G, resources, root, include_root=False, draw=True, de
     demand = nx.get_node_attributes(G, 'demand')
     utils = nx.get_node_attributes(G, 'util')
     
-    # remaining resources is just r - d if we have more than we need
-    # or 0 if it is a perfect multiple
-    # or the first multiple of resources > demand[root] - resources e.g. for d = 5 and r = 3, ceil(5/3)*5 = 6 -> 6-5 = 1 remaining resource
+    # round we are in, counting from 1, which sets the resources we get when we run out
+    schedule = resource_schedule(resources)
+    t = 1
+
+    # the root is recovered in the first round whose cumulative resources cover its demand, and the remaining
+    # resources are what is left of them, e.g. for d = 5 and r = 3, 6 - 5 = 1 remaining resource. If there are
+    # none, the root used up its round and counts towards its utility.
     if include_root:
         current_utility += utils[root]
 
-        if resources > demand[root]:
-            remaining_resources = resources - demand[root]
-        elif demand[root] % resources == 0:
-            remaining_resources = 0
+        t = schedule.round(demand[root], demand[root])
+        remaining_resources = schedule.available(t) - demand[root]
+        if remaining_resources == 0:
             total_utility += current_utility
-        else:
-            remaining_resources = math.ceil(demand[root]/resources)*resources - demand[root]
+            t += 1
 
         if debug:
             print('Remaining resources: ', remaining_resources)
@@ -353,7 +629,9 @@ def simulate_tree_recovery(G, resources, root, include_root=False, draw=True, de
 
     # must recover root first, no matter how long it takes. Start measuring total
     # utility after applying the first round of resources _after_ recovering root.
-    H = G.copy()
+    # The merged graph H is only kept up to date when we draw it.
+    if draw:
+        H = G.copy()
 
     # iteration counter for saving intermediate graphs
     i = 0
@@ -363,78 +641,104 @@ def simulate_tree_recovery(G, resources, root, include_root=False, draw=True, de
     if draw:
         pos = plot_graph(H, root, folder + '/{}.png'.format(i))
 
-    while H.number_of_nodes() > 1:
-        H = update(H, demand, utils)
-
-        if debug:
-            print('Current utility: ', current_utility, 'Total utility: ', total_utility)
-
-        # Dict of possible recovery nodes and their associated eval incomes
-        possible_recovery = {}
-
-        # find and iterate through all nodes adjacent to the root
-        neighbors = H.neighbors(root)
-        for neighbor in neighbors:
-            # print(neighbor, [utils[neighbor], demand[neighbor]])
-
-            # first create an unconnected component
-            test_graph = H.copy()
-            test_graph.remove_edge(root, neighbor)
+    # On a tree, the subgraph cut off by the edge between the root and one of its neighbors is the subtree of that
+    # neighbor, and it does not change as recovered nodes are merged into the root. So we compute the income of every
+    # subtree once with a post-order traversal, and keep the neighbors of the root in a heap ordered the way the
+    # merged graph would pick them: highest subtree income, then highest ratio, then first in the root's adjacency.
+    incomes = nx.get_node_attributes(G, 'income')
+    parent = dict(nx.bfs_predecessors(G, root))
+    subtree_income = {}
+    for node in reversed(list(nx.dfs_preorder_nodes(G, root))):
+        subtree_income[node] = subtree_income.get(node, 0) + incomes.get(node, 0)
+        if node != root:
+            subtree_income[parent[node]] = subtree_income.get(parent[node], 0) + subtree_income[node]
+
+    # networkx copies list the neighbors of a node that come before it in the node order first, sorted by that
+    # order, and the rest in their previous order. Merging appends the children of the recovered node to the
+    # neighbors of the root, and they only move into place at the next copy (the next merge).
+    position = {node: k for k, node in enumerate(G.nodes())}
+
+    def children_of(v):
+        children = [c for c in G.neighbors(v) if c != parent.get(v)]
+        return sorted([c for c in children if position[c] < position[v]], key=position.get) + \
+            [c for c in children if position[c] > position[v]]
+
+    order_after_root = itertools.count()
+    heap = []; current = {}
+
+    def push(node, group, seq):
+        # group 0: before the root in the node order, 1: after it, 2: appended by the last merge
+        entry = (-subtree_income[node], -(utils[node] / demand[node]), group, seq, node)
+        current[node] = entry
+        heapq.heappush(heap, entry)
+
+    def settle(node):
+        if position[node] < position[root]:
+            push(node, 0, position[node])
+        else:
+            push(node, 1, next(order_after_root))
 
-            # Now get the nodes of the subgraph in the unconnected component we just created
-            # (Not including the root)
-            subgraph_nodes = nx.node_connected_component(test_graph, neighbor)
-            subgraph_income = evaluate_total_income(test_graph.subgraph(subgraph_nodes))
+    for node in children_of(root):
+        settle(node)
+    appended = []
 
-            # update our possible move list with the income of the move if we recover this node
-            possible_recovery.update({neighbor: subgraph_income})
+    remaining_nodes = G.number_of_nodes() - 1
+    while remaining_nodes > 0:
+        if draw:
+            H = update(H, demand, utils)
 
         if debug:
-            print(possible_recovery)
+            print('Current utility: ', current_utility, 'Total utility: ', total_utility)
+            print({node: subtree_income[node] for node in current})
         i += 1
 
-        # choose the best move (look how pythonic this is)
-        recovery_nodes = [key for key in possible_recovery if possible_recovery[key] == max(possible_recovery.values())]
-        
-        if debug:
-            print(recovery_nodes)
-
-        # if multiple max nodes, choose the one with the best 'recovery ratio'
-        max_ratio = 0; recovery_node = recovery_nodes[0]
-        for node in recovery_nodes:
-            ratio = utils[node] / demand[node]
-            if ratio > max_ratio:
-                max_ratio = ratio
-                recovery_node = node
+        # choose the best move. A node we started recovering stays on top, its ratio only went up.
+        while current.get(heap[0][-1]) != heap[0]:
+            heapq.heappop(heap)
+        recovery_node = heap[0][-1]
 
         if debug:
             print('Recovering node: ', recovery_node, [utils[recovery_node], demand[recovery_node]])
 
         # Use all remaining resources if we had some from the previous turn, otherwise
-        # the amount of resources we are allocated this turn is our constant resource income
+        # the amount of resources we are allocated this turn is our resource income for round t
         if remaining_resources != 0:
             resources_this_turn = remaining_resources
             remaining_resources = 0
         else:
-            resources_this_turn = resources
+            resources_this_turn = schedule.budget(t)
 
         # if our demand is greater than the resources at this time step, apply all resources
         # and continue to the next step
         if demand[recovery_node] > resources_this_turn:
             demand[recovery_node] -= resources_this_turn
             total_utility += current_utility
+            t += 1
             continue
 
+        # the node is recovered: merge it with our root node. The nodes appended by the previous merge move into
+        # place, and the children of the recovered node are appended to the neighbors of the root.
+        heapq.heappop(heap)
+        del current[recovery_node]
+        for node in appended:
+            if node in current:
+                settle(node)
+        appended = children_of(recovery_node)
+        for seq, node in enumerate(appended):
+            push(node, 2, seq)
+        remaining_nodes -= 1
+        if draw:
+            H = merge_nodes(H, root, recovery_node, in_place=True)
+
         # If demand < supply this turn, we don't increment total utility yet because we still have resources leftover
         # We recover that node, and note our remaining resources for the next turn
-        elif demand[recovery_node] < resources_this_turn:
+        if demand[recovery_node] < resources_this_turn:
             remaining_resources = resources_this_turn - demand[recovery_node]
             demand[recovery_node] = 0
             current_utility += utils[recovery_node]
-            H = merge_nodes(H, root, recovery_node)
 
             # unless we're at the last step:
-            if H.number_of_nodes() == 1:
+            if remaining_nodes == 0:
                 total_utility += current_utility
                 break
 
@@ -447,12 +751,11 @@ def simulate_tree_recovery(G, resources, root, include_root=False, draw=True, de
             demand[recovery_node] = 0
             current_utility += utils[recovery_node]
 
-        # now we merge the node we recovered with our root node
-        H = merge_nodes(H, root, recovery_node)
         if draw:
             plot_graph(H, root, folder + '/{0}.png'.format(i), pos)
 
         # increment total utility
         total_utility += current_utility
+        t += 1
 
     return total_utility